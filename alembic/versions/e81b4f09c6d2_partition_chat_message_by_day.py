@@ -0,0 +1,94 @@
+"""Partition chat_message by day
+
+Revision ID: e81b4f09c6d2
+Revises: 3c71d0a5e2b8
+Create Date: 2026-10-18 16:05:52.730914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e81b4f09c6d2'
+down_revision = '3c71d0a5e2b8'
+branch_labels = None
+depends_on = None
+
+# Сколько дней вперед создать партиции сразу, дальше их создает chat.services.partitions
+DAYS_AHEAD = 7
+
+
+def upgrade():
+    # Декларативное секционирование с PRIMARY KEY на родителе требует Postgres 11+
+    op.execute("ALTER TABLE chat_message RENAME TO chat_message_old")
+    op.execute("ALTER TABLE chat_message_old RENAME CONSTRAINT chat_message_pkey TO chat_message_old_pkey")
+    op.execute("ALTER INDEX ix_chat_message_room_created_date_id RENAME TO ix_chat_message_old_room_created_date_id")
+    op.execute("ALTER TABLE chat_message_old ALTER COLUMN id DROP DEFAULT")
+
+    op.execute("""
+        CREATE TABLE chat_message (
+            id INTEGER NOT NULL DEFAULT nextval('chat_message_id_seq'),
+            room VARCHAR(50) NOT NULL DEFAULT 'main',
+            nickname VARCHAR(50) NOT NULL,
+            created_date TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            text TEXT NOT NULL,
+            CONSTRAINT chat_message_pkey PRIMARY KEY (id, created_date)
+        ) PARTITION BY RANGE (created_date)
+    """)
+    op.execute("ALTER SEQUENCE chat_message_id_seq OWNED BY chat_message.id")
+    op.create_index('ix_chat_message_room_created_date_id', 'chat_message', ['room', 'created_date', 'id'], unique=False)
+
+    # Партиции на каждый день, за который есть сообщения, и на DAYS_AHEAD дней вперед
+    op.execute(f"""
+        DO $$
+        DECLARE
+            day DATE;
+        BEGIN
+            FOR day IN
+                SELECT generate_series(
+                    LEAST(COALESCE((SELECT min(created_date)::date FROM chat_message_old), current_date), current_date),
+                    GREATEST(COALESCE((SELECT max(created_date)::date FROM chat_message_old), current_date), current_date + {DAYS_AHEAD}),
+                    interval '1 day'
+                )::date
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF chat_message FOR VALUES FROM (%L) TO (%L)',
+                    'chat_message_p' || to_char(day, 'YYYYMMDD'), day, day + 1
+                );
+            END LOOP;
+        END $$
+    """)
+
+    op.execute("""
+        INSERT INTO chat_message (id, room, nickname, created_date, text)
+        SELECT id, room, nickname, COALESCE(created_date, now()), text
+        FROM chat_message_old
+    """)
+    op.drop_table('chat_message_old')
+
+
+def downgrade():
+    op.execute("ALTER TABLE chat_message RENAME TO chat_message_partitioned")
+    op.execute("ALTER TABLE chat_message_partitioned RENAME CONSTRAINT chat_message_pkey TO chat_message_partitioned_pkey")
+    op.execute("ALTER INDEX ix_chat_message_room_created_date_id RENAME TO ix_chat_message_partitioned_room_created_date_id")
+    op.execute("ALTER TABLE chat_message_partitioned ALTER COLUMN id DROP DEFAULT")
+
+    op.create_table('chat_message',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('chat_message_id_seq')"), nullable=False),
+    sa.Column('room', sa.String(length=50), server_default='main', nullable=False),
+    sa.Column('nickname', sa.String(length=50), nullable=False),
+    sa.Column('created_date', sa.DateTime(), nullable=True),
+    sa.Column('text', sa.Text(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("ALTER SEQUENCE chat_message_id_seq OWNED BY chat_message.id")
+    op.create_index('ix_chat_message_room_created_date_id', 'chat_message', ['room', 'created_date', 'id'], unique=False)
+
+    op.execute("""
+        INSERT INTO chat_message (id, room, nickname, created_date, text)
+        SELECT id, room, nickname, created_date, text
+        FROM chat_message_partitioned
+    """)
+    # Партиции удаляются вместе с родительской таблицей
+    op.execute("DROP TABLE chat_message_partitioned")
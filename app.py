@@ -5,8 +5,64 @@ from aiohttp import web
 from loguru import logger
 
 import routes
-from config.settings import databases_
+from chat.services.backplane import create_backplane
+from chat.services import metrics
+from chat.services.connections import ConnectionRegistry
+from chat.services.drain import drain
+from chat.services.encoders import set_encoder
+from chat.services.partitions import create_partitions
+from chat.services.ids import IdAllocator
+from chat.services.persistence import MessagePersister
+from chat.services.ratelimit import RateLimiter
+from chat.services.reaper import Reaper
+from chat.services.relay import Relay
+from chat.services.rooms import RoomRegistry
+from chat.services.singleflight import SingleFlight
+from config.settings import (
+    databases_,
+    CHAT_ASYNCIO_DEBUG,
+    CHAT_DB,
+    CHAT_DEFAULT_ROOM,
+    CHAT_HISTORY_SIZE,
+    CHAT_HISTORY_MAX_CHARS,
+    CHAT_HISTORY_CACHE_TTL,
+    CHAT_IDLE_HISTORY_ROOMS,
+    CHAT_IDLE_HISTORY_TTL,
+    CHAT_SEND_QUEUE_SIZE,
+    CHAT_SLOW_CONSUMER_POLICY,
+    CHAT_JSON_ENCODER,
+    CHAT_PERSIST_BATCH_SIZE,
+    CHAT_PERSIST_FLUSH_INTERVAL,
+    CHAT_PERSIST_MAX_PENDING,
+    CHAT_PERSIST_RETRY_DELAY,
+    CHAT_PERSIST_MAX_RETRY_DELAY,
+    CHAT_PERSIST_SHUTDOWN_TIMEOUT,
+    CHAT_BACKPLANE,
+    CHAT_BACKPLANE_CHANNEL,
+    CHAT_BACKPLANE_MAX_PAYLOAD,
+    CHAT_BACKPLANE_HEARTBEAT,
+    CHAT_BACKPLANE_NODE_TIMEOUT,
+    CHAT_PARTITION_DAYS_AHEAD,
+    CHAT_EXPORT_CONCURRENCY,
+    CHAT_WS_IDLE_TIMEOUT,
+    CHAT_WS_REAP_INTERVAL,
+    CHAT_RATE_LIMIT,
+    CHAT_RATE_BURST,
+    CHAT_RATE_LIMIT_POLICY,
+    CHAT_COALESCE_WINDOW,
+    CHAT_COALESCE_MAX_BATCH,
+    CHAT_WS_COMPRESS_MIN_SIZE,
+    CHAT_ID_BLOCK_SIZE,
+    CHAT_DRAIN_TIMEOUT,
+    CHAT_RECONNECT_DELAY_MS,
+    CHAT_RECONNECT_JITTER_MS,
+    ACCESS_LOG_QUEUE_SIZE,
+    ACCESS_LOG_BATCH_SIZE,
+    ACCESS_LOG_FLUSH_INTERVAL,
+    ACCESS_LOG_SAMPLING,
+)
 from middlewares import log_middleware
+from utils.access_log import AccessLog, parse_sampling
 
 
 PROJ_ROOT = pathlib.Path(__file__).parent.parent
@@ -23,11 +79,59 @@ async def init_app(build='development', databases=databases_) -> web.Application
     :return: ``aiohttp.web.Application()``
     """
     loop = asyncio.get_event_loop()
-    loop.set_debug(True)
+    loop.set_debug(CHAT_ASYNCIO_DEBUG == '1' if CHAT_ASYNCIO_DEBUG else build == 'development')
 
     app = web.Application()
+
+    encoder = set_encoder(CHAT_JSON_ENCODER)
+    logger.info(f'JSON encoder: {encoder.__name__}')
     
-    app.wslist = {}
+    # Все соединения воркера, по несколько сессий на ник
+    app.connections = ConnectionRegistry()
+    # Воркер останавливается: новые подключения не принимаются
+    app.draining = False
+    app.rooms = RoomRegistry(
+        send_queue_size=CHAT_SEND_QUEUE_SIZE,
+        slow_consumer_policy=CHAT_SLOW_CONSUMER_POLICY,
+        history_size=CHAT_HISTORY_SIZE,
+        history_max_chars=CHAT_HISTORY_MAX_CHARS,
+        history_cache_ttl=CHAT_HISTORY_CACHE_TTL,
+        coalesce_window=CHAT_COALESCE_WINDOW,
+        coalesce_max_batch=CHAT_COALESCE_MAX_BATCH,
+        compress_min_size=CHAT_WS_COMPRESS_MIN_SIZE,
+        keep_rooms=(CHAT_DEFAULT_ROOM,),
+        idle_histories=CHAT_IDLE_HISTORY_ROOMS,
+        idle_history_ttl=CHAT_IDLE_HISTORY_TTL,
+    )
+    # Страницы GET /history: одинаковые запросы выполняются и сериализуются один раз
+    app.history_pages = SingleFlight(CHAT_HISTORY_CACHE_TTL)
+    app.persister = MessagePersister(
+        batch_size=CHAT_PERSIST_BATCH_SIZE,
+        flush_interval=CHAT_PERSIST_FLUSH_INTERVAL,
+        max_pending=CHAT_PERSIST_MAX_PENDING,
+        retry_delay=CHAT_PERSIST_RETRY_DELAY,
+        max_retry_delay=CHAT_PERSIST_MAX_RETRY_DELAY,
+    )
+    app.persister.start()
+    app.ids = IdAllocator(block_size=CHAT_ID_BLOCK_SIZE)
+    app.exports = asyncio.Semaphore(CHAT_EXPORT_CONCURRENCY)
+    app.limiter = None
+    if CHAT_RATE_LIMIT:
+        app.limiter = RateLimiter(rate=CHAT_RATE_LIMIT, burst=CHAT_RATE_BURST, policy=CHAT_RATE_LIMIT_POLICY)
+    app.reaper = Reaper(
+        app.rooms,
+        interval=CHAT_WS_REAP_INTERVAL,
+        idle_timeout=CHAT_WS_IDLE_TIMEOUT,
+        limiter=app.limiter,
+    )
+    app.reaper.start()
+    app.access_log = AccessLog(
+        maxsize=ACCESS_LOG_QUEUE_SIZE,
+        batch_size=ACCESS_LOG_BATCH_SIZE,
+        flush_interval=ACCESS_LOG_FLUSH_INTERVAL,
+        sampling=parse_sampling(ACCESS_LOG_SAMPLING),
+    )
+    app.access_log.start()
 
     middlewares = [
         log_middleware,
@@ -52,17 +156,64 @@ async def init_app(build='development', databases=databases_) -> web.Application
     await asyncio.gather(*db_tasks)
     logger.info('Initialized DB')
 
+    metrics.CONNECTIONS.set_function(lambda: len(app.connections))
+    metrics.ROOMS.set_function(lambda: len(app.rooms))
+    metrics.DB_POOL_SIZE.set_function(lambda: db_pool_stat('size'))
+    metrics.DB_POOL_IDLE.set_function(lambda: db_pool_stat('idle'))
+    metrics.DB_POOL_WAITERS.set_function(lambda: db_pool_stat('waiters'))
+
+    backplane = create_backplane(
+        CHAT_BACKPLANE,
+        dsn=CHAT_DB.cfg['dsn'],
+        channel=CHAT_BACKPLANE_CHANNEL,
+        max_payload=CHAT_BACKPLANE_MAX_PAYLOAD,
+    )
+    app.relay = Relay(app, backplane, heartbeat=CHAT_BACKPLANE_HEARTBEAT, node_timeout=CHAT_BACKPLANE_NODE_TIMEOUT)
+
     app.middlewares.extend(middlewares)
 
     app.on_startup.append(on_start)
     app.on_shutdown.append(on_shutdown)
+    app.on_cleanup.append(on_cleanup)
 
     return app
 
+def db_pool_stat(key: str) -> int:
+    # pool_stats читает внутренности asyncpg: их ошибка не должна ломать /metrics
+    try:
+        return CHAT_DB.pool_stats().get(key, 0)
+    except Exception:
+        logger.opt(exception=True).debug('Failed to read DB pool stats')
+        return 0
+
+
 async def on_start(app):
-    pass
+    created = await create_partitions(days_ahead=CHAT_PARTITION_DAYS_AHEAD)
+    logger.info(f'Partitions created: {created}')
+
+    history = app.rooms.ensure(CHAT_DEFAULT_ROOM).history
+    await history.warm_up()
+    logger.info(f'History warmed up: {len(history)} messages')
+
+    app.ids.refill()
+
+    await app.relay.start()
+    logger.info(f'Backplane {type(app.relay.backplane).__name__} started, node {app.relay.backplane.node_id}')
 
 
 async def on_shutdown(app: web.Application) -> None:
-    for ws in list(app.wslist.values()):
-        await ws.close()
+    app.reaper.stop()
+    await drain(
+        app,
+        timeout=CHAT_DRAIN_TIMEOUT,
+        reconnect_delay=CHAT_RECONNECT_DELAY_MS,
+        reconnect_jitter=CHAT_RECONNECT_JITTER_MS,
+    )
+
+    await app.relay.stop()
+    await app.persister.stop(timeout=CHAT_PERSIST_SHUTDOWN_TIMEOUT)
+
+
+async def on_cleanup(app: web.Application) -> None:
+    # Обработчики уже завершились, их записи в журнале последние
+    await app.access_log.stop()
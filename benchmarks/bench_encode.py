@@ -0,0 +1,87 @@
+"""
+Микробенчмарк сериализации одного сообщения при рассылке.
+
+Сравнивает старый путь (``send_json`` = ``json.dumps`` на каждого получателя)
+с сериализацией один раз на рассылку для всех доступных энкодеров,
+а затем размер сообщения и время одной сериализации в JSON и MessagePack
+(подпротокол ``chat.msgpack``, если установлен ``msgpack``).
+
+Запуск: ``python -m benchmarks.bench_encode --recipients 1000 10000``
+"""
+import argparse
+import json
+import time
+
+from chat.services.encoders import ENCODERS, msgpack, msgpack_dumps
+
+
+def make_message(text_size: int) -> dict:
+    """ Сообщение чата в том виде, в каком его рассылает сервер (``HistoryMessage.to_dict``). """
+    return {
+        'id': 123456,
+        'text': ('Привет всем! ' * (text_size // 13 + 1))[:text_size],
+        'user': 'tester',
+        'time': '12:34',
+    }
+
+
+def per_recipient(message: dict, recipients: int) -> None:
+    for _ in range(recipients):
+        json.dumps(message)
+
+
+def once(encoder, message: dict, recipients: int) -> None:
+    payload = encoder(message)
+    for _ in range(recipients):
+        # Получатели разделяют одну и ту же строку
+        _ = payload
+
+
+def timeit(func, *args, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.process_time()
+        func(*args)
+        best = min(best, time.process_time() - start)
+    return best
+
+
+def encode_many(encoder, message: dict, count: int) -> None:
+    for _ in range(count):
+        encoder(message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--recipients', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--text-size', type=int, default=52, help='длина текста сообщения, символов')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--encodes', type=int, default=10000, help='сериализаций для замера по протоколам')
+    args = parser.parse_args()
+
+    message = make_message(args.text_size)
+
+    for recipients in args.recipients:
+        baseline = timeit(per_recipient, message, recipients, repeat=args.repeat)
+        print(f'recipients={recipients}')
+        print(f'  json.dumps per recipient: {baseline * 1000:10.3f} ms CPU')
+
+        for name, encoder in ENCODERS.items():
+            elapsed = timeit(once, encoder, message, recipients, repeat=args.repeat)
+            print(f'  {name:>6} once per broadcast: {elapsed * 1000:10.3f} ms CPU '
+                  f'(saved {(baseline - elapsed) * 1000:.3f} ms, x{baseline / max(elapsed, 1e-9):.0f})')
+
+    protocols = {name: encoder for name, encoder in ENCODERS.items()}
+    if msgpack is not None:
+        protocols['msgpack'] = msgpack_dumps
+
+    print(f'protocols, {args.encodes} encodes')
+    for name, encoder in protocols.items():
+        payload = encoder(message)
+        size = len(payload.encode() if isinstance(payload, str) else payload)
+        elapsed = timeit(encode_many, encoder, message, args.encodes, repeat=args.repeat)
+        print(f'  {name:>7}: {size:6d} bytes, {elapsed / args.encodes * 1e6:8.3f} us CPU per encode')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Микробенчмарк накладных расходов на частые запросы чата.
+
+Сравнивает путь через ORM (выражение SQLAlchemy, компиляция Gino, модели
+``ChatMessage``) с ``chat.services.statements`` (готовый SQL, подготовленный
+на соединении, записи asyncpg). Все запросы идут на одном соединении внутри
+транзакции, которая в конце откатывается.
+
+Нужна тестовая БД из ``.env`` (TEST_DB_URL) с накатанными миграциями.
+
+Запуск: ``python -m benchmarks.bench_queries --iterations 2000``
+"""
+import argparse
+import asyncio
+import time
+
+from chat.services import statements
+from chat.services.querysets import get_last_chat_message_queryset
+from config.models.chat_models import ChatMessage
+from config.settings import CHAT_ENGINE as db, DB_BINDINGS
+
+ROOM = 'bench_queries'
+
+
+async def timeit(func, iterations: int) -> float:
+    """ Среднее время одного вызова, мкс. """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def run(args):
+    await db.set_bind(DB_BINDINGS['chat']['test']['dsn'])
+
+    async with db.acquire() as conn:
+        async with conn.transaction() as tx:
+            for i in range(args.history):
+                await statements.create_chat_message('bench', f'text {i}', room=ROOM, bind=conn)
+
+            cases = {
+                'create': (
+                    lambda: ChatMessage.create(nickname='bench', text='text', room=ROOM, bind=conn),
+                    lambda: statements.create_chat_message('bench', 'text', room=ROOM, bind=conn),
+                ),
+                'last': (
+                    lambda: get_last_chat_message_queryset(ROOM, limit=args.limit).gino.all(bind=conn),
+                    lambda: statements.get_last_chat_messages(ROOM, limit=args.limit, bind=conn),
+                ),
+            }
+
+            print(f'{"query":<8}{"orm, us":>12}{"prepared, us":>16}{"speedup":>10}')
+            for name, (orm, prepared) in cases.items():
+                # Прогрев: кэши компиляции Gino и подготовленные запросы asyncpg
+                await timeit(orm, 10)
+                await timeit(prepared, 10)
+
+                orm_us = await timeit(orm, args.iterations)
+                prepared_us = await timeit(prepared, args.iterations)
+                print(f'{name:<8}{orm_us:>12.1f}{prepared_us:>16.1f}{orm_us / prepared_us:>9.1f}x')
+
+            tx.raise_rollback()
+
+    await db.pop_bind().close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--history', type=int, default=100, help='сообщений в комнате перед замером')
+    parser.add_argument('--limit', type=int, default=30)
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
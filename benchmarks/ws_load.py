@@ -0,0 +1,283 @@
+"""
+Нагрузочный тест чата через WebSocket.
+
+Поднимает ``init_app(build='test')`` в отдельном процессе, подключает
+``--clients`` клиентов к ``/ws/{room}/{user}``, и ``--senders`` из них шлют
+сообщения с общей частотой ``--rate`` в секунду. Считает:
+
+- задержку рассылки (от отправки до получения каждым клиентом) p50/p99;
+- отправленные и доставленные сообщения в секунду;
+- задержку входа: от начала подключения до первого фрейма (история берется до него);
+- прирост RSS сервера на одно соединение и сколько из него осталось после
+  отключения всех клиентов (``--sessions`` подключает одни и те же ники
+  несколькими вкладками);
+- байты, записанные сервером в сокеты, на одну доставку и CPU сервера
+  на сообщение - чтобы сравнивать настройки сжатия (``--compress``,
+  ``--compress-min-size``, ``--payload``).
+
+Результат пишется в JSON (``--output``), чтобы сравнивать коммиты между собой.
+Нужна тестовая БД из ``.env`` (TEST_DB_URL) с накатанными миграциями.
+
+Запуск: ``python -m benchmarks.ws_load --clients 1000 --senders 10 --rate 100 --duration 30``
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import time
+
+import aiohttp
+
+# Префикс текста сообщений теста: по нему клиент отличает свои сообщения от истории
+MARK = 'ws_load'
+
+
+def percentile(samples: list, q: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * q), len(samples) - 1)]
+
+
+def read_rss(pid: int) -> int:
+    """ Resident set size процесса, байт. """
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def read_cpu(pid: int) -> float:
+    """ Процессорное время процесса (user + system), сек. """
+    with open(f'/proc/{pid}/stat') as f:
+        # Имя процесса в скобках может содержать пробелы
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def read_written(pid: int) -> int:
+    """ Байты, которые процесс передал в write/send. """
+    with open(f'/proc/{pid}/io') as f:
+        for line in f:
+            if line.startswith('wchar:'):
+                return int(line.split()[1])
+    return 0
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def serve(host: str, port: int, env: dict):
+    """ Сервер в дочернем процессе. Настройки читаются из окружения при импорте. """
+    os.environ.update(env)
+
+    from aiohttp import web
+
+    from app import init_app
+
+    web.run_app(init_app(build='test'), host=host, port=port, print=None)
+
+
+async def wait_server(session: aiohttp.ClientSession, url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+
+        if time.monotonic() > deadline:
+            raise RuntimeError('Server did not start')
+        await asyncio.sleep(0.2)
+
+
+class Client:
+    """ Подключение одного пользователя и его статистика. """
+
+    def __init__(self, session: aiohttp.ClientSession, url: str, stats: dict, compress: bool, padding: str):
+        self.session = session
+        self.url = url
+        self.stats = stats
+        self.compress = compress
+        self.padding = padding
+        self.ws = None
+        self.connected = asyncio.Event()
+        self._task = None
+
+    async def connect(self):
+        start = time.perf_counter()
+        self.ws = await self.session.ws_connect(self.url, max_msg_size=0, compress=15 if self.compress else 0)
+        self._task = asyncio.ensure_future(self._reader(start))
+        await self.connected.wait()
+
+    async def send(self):
+        await self.ws.send_str(f'{MARK}:{time.perf_counter_ns()}:{self.padding}')
+        self.stats['sent'] += 1
+
+    async def close(self):
+        await self.ws.close()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _reader(self, start: float):
+        async for msg in self.ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                continue
+
+            now = time.perf_counter_ns()
+            if not self.connected.is_set():
+                self.stats['join'].append(time.perf_counter() - start)
+                self.connected.set()
+
+            frames = json.loads(msg.data)
+            for frame in frames if isinstance(frames, list) else [frames]:
+                text = frame.get('text')
+                if text and text.startswith(MARK):
+                    self.stats['received'] += 1
+                    self.stats['latency'].append((now - int(text.split(':')[1])) / 1e9)
+
+
+async def run(args) -> dict:
+    base = f'http://{args.host}:{args.port}'
+    stats = {'sent': 0, 'received': 0, 'latency': [], 'join': []}
+    connector = aiohttp.TCPConnector(limit=0)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await wait_server(session, f'{base}/test')
+        rss_before = read_rss(args.server_pid)
+
+        padding = 'x' * args.payload
+        clients = [
+            Client(session, f'{base}/ws/{args.room}/user{i // args.sessions}', stats,
+                   compress=args.compress, padding=padding)
+            for i in range(args.clients)
+        ]
+        semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+        async def connect(client):
+            async with semaphore:
+                await client.connect()
+
+        await asyncio.gather(*(connect(client) for client in clients))
+        await asyncio.sleep(1)
+        rss_after = read_rss(args.server_pid)
+
+        senders = clients[:args.senders]
+        interval = 1 / args.rate
+        stats['latency'].clear()
+        stats['received'] = 0
+
+        cpu_before = read_cpu(args.server_pid)
+        written_before = read_written(args.server_pid)
+        start = time.perf_counter()
+        i = 0
+        while time.perf_counter() - start < args.duration:
+            await senders[i % len(senders)].send()
+            i += 1
+            # Держим общий темп, а не интервал между отправками
+            delay = start + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elapsed = time.perf_counter() - start
+
+        # Даем дойти хвосту рассылки
+        await asyncio.sleep(args.drain)
+        cpu = read_cpu(args.server_pid) - cpu_before
+        written = read_written(args.server_pid) - written_before
+
+        await asyncio.gather(*(client.close() for client in clients))
+        await asyncio.sleep(1)
+        rss_closed = read_rss(args.server_pid)
+
+    return {
+        'commit': git_commit(),
+        'params': {
+            'clients': args.clients,
+            'sessions': args.sessions,
+            'senders': args.senders,
+            'rate': args.rate,
+            'duration': args.duration,
+            'payload': args.payload,
+            'compress': args.compress,
+            'compress_min_size': args.compress_min_size,
+        },
+        'results': {
+            'sent_per_sec': stats['sent'] / elapsed,
+            'delivered_per_sec': stats['received'] / elapsed,
+            'delivered_ratio': stats['received'] / max(stats['sent'] * args.clients, 1),
+            'fanout_latency_p50_ms': percentile(stats['latency'], 0.5) * 1000,
+            'fanout_latency_p99_ms': percentile(stats['latency'], 0.99) * 1000,
+            'join_latency_p50_ms': percentile(stats['join'], 0.5) * 1000,
+            'join_latency_p99_ms': percentile(stats['join'], 0.99) * 1000,
+            'rss_per_connection_bytes': (rss_after - rss_before) / max(args.clients, 1),
+            'rss_retained_per_connection_bytes': (rss_closed - rss_before) / max(args.clients, 1),
+            'server_bytes_per_delivery': written / max(stats['received'], 1),
+            'server_cpu_per_message_us': cpu / max(stats['sent'], 1) * 1e6,
+            'server_cpu_per_delivery_us': cpu / max(stats['received'], 1) * 1e6,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--senders', type=int, default=10)
+    parser.add_argument('--sessions', type=int, default=1, help='соединений на один ник')
+    parser.add_argument('--rate', type=float, default=50, help='сообщений в секунду от всех отправителей')
+    parser.add_argument('--duration', type=float, default=10, help='сек.')
+    parser.add_argument('--drain', type=float, default=2, help='ожидание хвоста рассылки, сек.')
+    parser.add_argument('--payload', type=int, default=0, help='дополнительных символов в сообщении')
+    parser.add_argument('--compress', type=int, choices=(0, 1), default=1,
+                        help='согласовывать permessage-deflate (CHAT_WS_COMPRESS)')
+    parser.add_argument('--compress-min-size', type=int, default=256,
+                        help='порог сжатия сервера, символов (CHAT_WS_COMPRESS_MIN_SIZE)')
+    parser.add_argument('--room', default='ws_load')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--connect-concurrency', type=int, default=100)
+    parser.add_argument('--output', default='ws_load.json')
+    args = parser.parse_args()
+    args.senders = max(min(args.senders, args.clients), 1)
+    args.sessions = max(args.sessions, 1)
+
+    # Каждому клиенту по сокету в этом процессе и в сервере
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    env = {
+        'CHAT_WS_COMPRESS': str(args.compress),
+        'CHAT_WS_COMPRESS_MIN_SIZE': str(args.compress_min_size),
+        # Тест меряет рассылку: лимит сообщений и соединений на воркер не должен в нее вмешиваться
+        'CHAT_RATE_LIMIT': '0',
+        'CHAT_WS_MAX_CONNECTIONS': str(max(args.clients * 2, 10_000)),
+        # Отладочный режим asyncio замедляет сервер и исказил бы замер
+        'CHAT_ASYNCIO_DEBUG': '0',
+    }
+    server = multiprocessing.Process(target=serve, args=(args.host, args.port, env), daemon=True)
+    server.start()
+    args.server_pid = server.pid
+
+    try:
+        result = asyncio.get_event_loop().run_until_complete(run(args))
+    finally:
+        server.terminate()
+        server.join()
+
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,18 @@
-from chat.views import Index, WebSocket
+from chat.views import Index, History, Export, WebSocket
 
 
 chat_ws_url = '/ws/{user}'
+chat_room_ws_url = '/ws/{room}/{user}'
 test_url = '/test'
+history_url = '/history'
+export_url = '/export'
 
 
 routes = [
     (chat_ws_url, WebSocket),
+    (chat_room_ws_url, WebSocket),
     (test_url, Index),
+    (history_url, History),
+    (export_url, Export),
     
     ]
\ No newline at end of file
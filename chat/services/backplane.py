@@ -0,0 +1,301 @@
+import asyncio
+import collections
+import itertools
+import json
+import uuid
+from abc import ABCMeta, abstractmethod
+from typing import Callable, Dict, List, Optional, Set
+
+import asyncpg
+from loguru import logger
+
+# handler(node, kind, data)
+Handler = Callable[[str, str, dict], None]
+
+# Сколько больших сообщений может собираться из частей одновременно
+MAX_ASSEMBLING = 64
+# Сколько сообщений шины копить, пока отправка не удается; старые вытесняются
+MAX_OUTBOX = 10000
+# Через сколько секунд повторять неудавшуюся отправку
+RETRY_DELAY = 1
+
+
+class Backplane(metaclass=ABCMeta):
+    """
+    Шина событий между воркерами и хостами.
+
+    ``publish`` не блокируется: события складываются в очередь, которую
+    разбирает одна задача, поэтому порядок событий сохраняется. Каждый узел
+    получает события всех узлов, кроме своих (по ``node_id``). У каждого
+    события узла свой порядковый номер (``seq``), поэтому одинаковые события
+    не склеиваются (Postgres доставляет одинаковые NOTIFY одной транзакции
+    один раз). Событие,
+    которое не помещается в ``max_payload`` байт, режется на части и
+    собирается на принимающей стороне.
+
+    Если отправка не удалась, события возвращаются в очередь и отправляются
+    повторно через ``RETRY_DELAY`` секунд. После переподключения к шине
+    вызывается ``on_reconnect``: пока узел был отключен, он пропускал события.
+
+    :param channel: имя канала
+    :param max_payload: максимальный размер одного сообщения шины, байт
+    """
+
+    def __init__(self, channel: str, max_payload: int):
+        self.channel = channel
+        self.max_payload = max_payload
+        self.node_id = uuid.uuid4().hex
+
+        self.published = 0
+        self.received = 0
+
+        self._handler: Optional[Handler] = None
+        self._on_reconnect: Optional[Callable[[], None]] = None
+        self._outbox = collections.deque()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._chunk_ids = itertools.count()
+        self._seq = itertools.count()
+        self._assembling: Dict[str, list] = collections.OrderedDict()
+
+    async def start(self, handler: Handler, on_reconnect: Optional[Callable[[], None]] = None) -> None:
+        self._handler = handler
+        self._on_reconnect = on_reconnect
+        await self._connect()
+        self._task = asyncio.ensure_future(self._sender())
+
+    async def stop(self) -> None:
+        """ Отправляет накопленные события и отключается. """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            await self._flush()
+
+        await self._disconnect()
+
+    def publish(self, kind: str, data: dict) -> None:
+        payload = json.dumps({'node': self.node_id, 'seq': next(self._seq), 'kind': kind, 'data': data})
+        self._outbox.extend(self._split(payload))
+        if len(self._outbox) > MAX_OUTBOX:
+            dropped = len(self._outbox) - MAX_OUTBOX
+            for _ in range(dropped):
+                self._outbox.popleft()
+            logger.warning(f'Backplane outbox is full, {dropped} oldest payloads dropped')
+        self._wakeup.set()
+        self.published += 1
+
+    @abstractmethod
+    async def _connect(self) -> None:
+        """ Подключение к шине и подписка на канал. """
+
+    @abstractmethod
+    async def _disconnect(self) -> None:
+        """ Отписка и закрытие соединений. """
+
+    @abstractmethod
+    async def _send(self, payloads: List[str]) -> None:
+        """ Отправляет сообщения шины по порядку. """
+
+    async def _sender(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                await self._flush()
+            except Exception as e:
+                logger.warning(f'Backplane publish failed, retrying in {RETRY_DELAY}s: {e!r}')
+                await asyncio.sleep(RETRY_DELAY)
+                self._wakeup.set()
+
+    async def _flush(self):
+        while self._outbox:
+            payloads = list(self._outbox)
+            self._outbox.clear()
+            try:
+                await self._send(payloads)
+            except BaseException:
+                # Перед событиями, опубликованными во время отправки
+                self._outbox.extendleft(reversed(payloads))
+                raise
+
+    def _reconnected(self) -> None:
+        if self._on_reconnect is None:
+            return
+        try:
+            self._on_reconnect()
+        except Exception:
+            logger.exception('Backplane reconnect handler failed')
+
+    def _split(self, payload: str) -> List[str]:
+        # json.dumps по умолчанию дает ASCII, поэтому длина строки равна размеру в байтах
+        if len(payload) <= self.max_payload:
+            return [payload]
+
+        # Внутри строки JSON кавычки и слэши экранируются, часть может вырасти вдвое
+        size = max((self.max_payload - 200) // 2, 1)
+        parts = [payload[i:i + size] for i in range(0, len(payload), size)]
+        chunk_id = f'{self.node_id}:{next(self._chunk_ids)}'
+
+        return [
+            json.dumps({'node': self.node_id, 'chunk': chunk_id, 'seq': seq, 'total': len(parts), 'part': part})
+            for seq, part in enumerate(parts)
+        ]
+
+    def _receive(self, payload: str) -> None:
+        envelope = json.loads(payload)
+
+        if envelope['node'] == self.node_id:
+            return
+
+        if 'chunk' in envelope:
+            payload = self._assemble(envelope)
+            if payload is None:
+                return
+            envelope = json.loads(payload)
+
+        self.received += 1
+        try:
+            self._handler(envelope['node'], envelope['kind'], envelope['data'])
+        except Exception:
+            logger.exception(f'Backplane handler failed on {envelope["kind"]!r}')
+
+    def _assemble(self, envelope: dict) -> Optional[str]:
+        chunk_id = envelope['chunk']
+        parts = self._assembling.get(chunk_id)
+
+        if parts is None:
+            parts = self._assembling[chunk_id] = [None] * envelope['total']
+            while len(self._assembling) > MAX_ASSEMBLING:
+                stale, _ = self._assembling.popitem(last=False)
+                logger.warning(f'Backplane message {stale} was not assembled and is dropped')
+
+        parts[envelope['seq']] = envelope['part']
+        if any(part is None for part in parts):
+            return None
+
+        del self._assembling[chunk_id]
+        return ''.join(parts)
+
+
+class LocalBackplane(Backplane):
+    """
+    Шина внутри одного процесса: для тестов и для запуска с одним воркером.
+    Узлы с одинаковым ``channel`` видят события друг друга.
+    """
+
+    _hubs: Dict[str, Set['LocalBackplane']] = collections.defaultdict(set)
+
+    async def _connect(self) -> None:
+        self._hubs[self.channel].add(self)
+
+    async def _disconnect(self) -> None:
+        self._hubs[self.channel].discard(self)
+
+    async def _send(self, payloads: List[str]) -> None:
+        loop = asyncio.get_event_loop()
+        for node in self._hubs[self.channel]:
+            for payload in payloads:
+                loop.call_soon(node._receive, payload)
+
+
+class PostgresBackplane(Backplane):
+    """
+    Шина на Postgres LISTEN/NOTIFY.
+
+    Слушает канал на отдельном соединении, а публикует через маленький пул:
+    все накопленные события уходят одной транзакцией, и Postgres доставляет
+    их подписчикам в том же порядке.
+
+    Каждые ``check_interval`` секунд соединение подписки проверяется
+    запросом; если оно разорвано (например, Postgres перезапустился), узел
+    переподключается и снова подписывается на канал.
+
+    :param dsn: строка подключения к БД
+    :param check_interval: период проверки соединения подписки, сек.
+    """
+
+    # Postgres ограничивает payload NOTIFY 8000 байтами
+    MAX_NOTIFY_PAYLOAD = 7900
+
+    def __init__(self, dsn: str, channel: str, max_payload: int = MAX_NOTIFY_PAYLOAD, check_interval: float = 5):
+        super().__init__(channel=channel, max_payload=min(max_payload, self.MAX_NOTIFY_PAYLOAD))
+        self.dsn = dsn
+        self.check_interval = check_interval
+        self.reconnects = 0
+        self._listener = None
+        self._pool = None
+        self._watcher = None
+
+    async def _connect(self) -> None:
+        await self._listen()
+        self._pool = await asyncpg.create_pool(dsn=self.dsn, min_size=1, max_size=2)
+        self._watcher = asyncio.ensure_future(self._watch())
+
+    async def _listen(self) -> None:
+        self._listener = await asyncpg.connect(dsn=self.dsn)
+        await self._listener.add_listener(self.channel, self._on_notify)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await asyncio.wait_for(self._listener.fetchval('SELECT 1'), timeout=self.check_interval)
+                continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f'Backplane listener connection is lost, reconnecting: {e!r}')
+
+            self._listener.terminate()
+            try:
+                await self._listen()
+            except Exception as e:
+                logger.warning(f'Backplane reconnect failed: {e!r}')
+                continue
+
+            self.reconnects += 1
+            logger.info(f'Backplane listener reconnected to channel {self.channel!r}')
+            self._reconnected()
+
+    async def _disconnect(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+
+        if self._listener is not None:
+            if not self._listener.is_closed():
+                await self._listener.remove_listener(self.channel, self._on_notify)
+                await self._listener.close()
+            self._listener = None
+
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def _send(self, payloads: List[str]) -> None:
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany(
+                    'SELECT pg_notify($1, $2)',
+                    [(self.channel, payload) for payload in payloads],
+                )
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self._receive(payload)
+
+
+BACKPLANES = ('local', 'postgres')
+
+
+def create_backplane(kind: str, dsn: str, channel: str, max_payload: int) -> Backplane:
+    """
+    :param kind: ``'local'`` - один процесс, ``'postgres'`` - LISTEN/NOTIFY
+    :param dsn: строка подключения к БД, нужна для ``'postgres'``
+    """
+    if kind == 'local':
+        return LocalBackplane(channel=channel, max_payload=max_payload)
+
+    if kind == 'postgres':
+        return PostgresBackplane(dsn=dsn, channel=channel, max_payload=max_payload)
+
+    raise ValueError(f'Unknown backplane: {kind}, choose from {BACKPLANES}')
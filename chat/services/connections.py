@@ -0,0 +1,55 @@
+from typing import TYPE_CHECKING, Dict, Iterator
+
+if TYPE_CHECKING:
+    # fanout сам держит соединения комнаты в ConnectionRegistry
+    from chat.services.fanout import Sender
+
+
+class ConnectionRegistry:
+    """
+    Реестр соединений: у одного ника может быть несколько сессий (вкладок).
+
+    Запись соединения - ``Sender``: сокет, ник, время подключения, счетчики
+    и исходящая очередь. Соединения хранятся в словарях-множествах
+    (``{sender: None}``), поэтому добавление и удаление - O(1), а порядок
+    подключения сохраняется.
+
+    Итерация идет по самому словарю без копии: во время обхода нельзя
+    добавлять и удалять соединения. Закрытие соединения (``Sender.close``)
+    реестр не меняет - соединение удаляет обработчик ``WebSocket.get``,
+    когда его цикл чтения завершится.
+    """
+
+    def __init__(self):
+        self._senders: Dict['Sender', None] = {}
+        self._users: Dict[str, Dict['Sender', None]] = {}
+
+    def __len__(self) -> int:
+        return len(self._senders)
+
+    def __iter__(self) -> Iterator['Sender']:
+        return iter(self._senders)
+
+    def __contains__(self, sender: 'Sender') -> bool:
+        return sender in self._senders
+
+    def add(self, sender: 'Sender') -> None:
+        self._senders[sender] = None
+        self._users.setdefault(sender.user, {})[sender] = None
+
+    def remove(self, sender: 'Sender') -> None:
+        if sender not in self._senders:
+            return
+
+        del self._senders[sender]
+        sessions = self._users[sender.user]
+        del sessions[sender]
+        if not sessions:
+            del self._users[sender.user]
+
+    def sessions(self, user: str) -> Iterator['Sender']:
+        """ Сессии ника в порядке подключения. """
+        return iter(self._users.get(user, ()))
+
+    def count(self, user: str) -> int:
+        return len(self._users.get(user, ()))
@@ -0,0 +1,60 @@
+import asyncio
+import random
+
+from aiohttp import web, WSCloseCode
+from loguru import logger
+
+from chat.services.encoders import Frame
+from chat.services.fanout import Sender
+
+# Служебное событие: сервер останавливается, переподключиться через after_ms
+RECONNECT = 'reconnect'
+
+
+async def drain(app: web.Application, timeout: float, reconnect_delay: int, reconnect_jitter: int) -> int:
+    """
+    Закрывает все соединения воркера при остановке.
+
+    Новые подключения получают 503 (``app.draining``). Каждому клиенту уходит
+    ``{"type": "reconnect", "after_ms": ...}`` со случайной задержкой от
+    ``reconnect_delay`` до ``reconnect_delay + reconnect_jitter`` мс, чтобы
+    клиенты не переподключались все разом. Соединения закрываются
+    параллельно: каждое - после отправки своей очереди, все - не дольше
+    ``timeout`` секунд.
+
+    :return: сколько соединений закрыто до дедлайна
+    """
+    app.draining = True
+
+    senders = []
+    for room in list(app.rooms):
+        # Склеенные сообщения уходят, а события выхода закрывающихся соединений -
+        # нет: иначе каждое закрытие ставит фрейм в очереди всех остальных, O(N²)
+        room.fanout.close()
+        senders.extend(sender for sender in room.fanout if not sender.closing)
+
+    if not senders:
+        return 0
+
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout
+
+    async def close(sender: Sender):
+        after_ms = reconnect_delay + random.randint(0, reconnect_jitter)
+        sender.put(Frame({'type': RECONNECT, 'after_ms': after_ms}))
+        try:
+            await asyncio.wait_for(sender.flush(), timeout=max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            pass
+
+        # Код запоминается в Sender: с ним же закроет сокет обработчик соединения
+        sender.close(WSCloseCode.GOING_AWAY, b'server shutdown')
+        await sender.ws.close(code=sender.close_code, message=sender.close_message)
+
+    tasks = [asyncio.ensure_future(close(sender)) for sender in senders]
+    done, pending = await asyncio.wait(tasks, timeout=max(deadline - loop.time(), 0))
+    for task in pending:
+        task.cancel()
+
+    logger.info(f'Drained {len(done)} connections, {len(pending)} were not closed in {timeout}s')
+    return len(done)
@@ -0,0 +1,137 @@
+import json
+import struct
+from typing import Any, Callable, List, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - необязательная зависимость
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - необязательная зависимость
+    msgpack = None
+
+# --- Подпротоколы WebSocket. Без подпротокола фреймы текстовые, JSON
+JSON_PROTOCOL = 'chat.json'
+MSGPACK_PROTOCOL = 'chat.msgpack'
+
+Encoder = Callable[[Any], str]
+
+
+def stdlib_dumps(obj: Any) -> str:
+    return json.dumps(obj)
+
+
+def orjson_dumps(obj: Any) -> str:
+    # Текстовый фрейм: клиенты ждут строку, а не бинарные данные
+    return orjson.dumps(obj).decode()
+
+
+ENCODERS = {
+    'json': stdlib_dumps,
+}
+if orjson is not None:
+    ENCODERS['orjson'] = orjson_dumps
+
+_encoder: Encoder = stdlib_dumps
+
+
+def set_encoder(name: str = 'auto') -> Encoder:
+    """
+    Выбирает JSON-энкодер для исходящих сообщений.
+
+    :param name: ключ из ``ENCODERS`` или ``'auto'`` - самый быстрый из
+        установленных, иначе стандартный ``json``
+    :return: выбранный энкодер
+    """
+    global _encoder
+
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in ENCODERS else 'json'
+
+    if name not in ENCODERS:
+        raise ValueError(f'JSON encoder {name!r} is not available, choose from {sorted(ENCODERS)}')
+
+    _encoder = ENCODERS[name]
+    return _encoder
+
+
+def encode(message: Any) -> str:
+    """ Сериализует сообщение один раз, результат отправляется всем получателям. """
+    return _encoder(message)
+
+
+def msgpack_dumps(obj: Any) -> bytes:
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def msgpack_loads(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False)
+
+
+def msgpack_array_header(size: int) -> bytes:
+    """ Заголовок массива MessagePack: дальше идут его элементы подряд. """
+    if size < 16:
+        return bytes((0x90 | size,))
+    if size < 0x10000:
+        return b'\xdc' + struct.pack('>H', size)
+    return b'\xdd' + struct.pack('>I', size)
+
+
+def protocols(msgpack_enabled: bool) -> tuple:
+    """ Подпротоколы, которые сервер предлагает клиентам. """
+    if msgpack_enabled and msgpack is not None:
+        return MSGPACK_PROTOCOL, JSON_PROTOCOL
+    return (JSON_PROTOCOL,)
+
+
+class Frame:
+    """
+    Исходящее сообщение. Кодируется лениво и не больше одного раза на каждый
+    протокол, сколько бы соединений его ни отправляли.
+    """
+
+    __slots__ = ('message', '_json', '_msgpack')
+
+    def __init__(self, message: Any):
+        self.message = message
+        self._json: Optional[str] = None
+        self._msgpack: Optional[bytes] = None
+
+    @property
+    def json(self) -> str:
+        if self._json is None:
+            self._json = encode(self.message)
+        return self._json
+
+    @property
+    def msgpack(self) -> bytes:
+        if self._msgpack is None:
+            self._msgpack = msgpack_dumps(self.message)
+        return self._msgpack
+
+
+class BatchFrame(Frame):
+    """
+    Несколько сообщений одним фреймом-массивом. Массив собирается из уже
+    закодированных сообщений, без повторной сериализации.
+    """
+
+    __slots__ = ('frames',)
+
+    def __init__(self, frames: List[Frame]):
+        super().__init__(None)
+        self.frames = frames
+
+    @property
+    def json(self) -> str:
+        if self._json is None:
+            self._json = '[' + ','.join(frame.json for frame in self.frames) + ']'
+        return self._json
+
+    @property
+    def msgpack(self) -> bytes:
+        if self._msgpack is None:
+            self._msgpack = msgpack_array_header(len(self.frames)) + b''.join(frame.msgpack for frame in self.frames)
+        return self._msgpack
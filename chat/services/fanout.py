@@ -0,0 +1,265 @@
+import asyncio
+import collections
+import time
+from typing import Iterator, List
+
+from aiohttp import web, WSCloseCode
+from loguru import logger
+
+from chat.services.connections import ConnectionRegistry
+from chat.services.encoders import Frame, BatchFrame, MSGPACK_PROTOCOL
+from chat.services.metrics import MESSAGES_OUT, MESSAGES_DROPPED, COALESCE_DELAY_SECONDS, COALESCE_BATCH_SIZE
+
+# --- Что делать, если исходящая очередь соединения переполнена
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+DISCONNECT = 'disconnect'
+
+POLICIES = (DROP_OLDEST, DROP_NEWEST, DISCONNECT)
+
+
+class Sender:
+    """
+    Запись одного соединения: сокет, ник, счетчики, исходящая очередь
+    и задача, которая ее разбирает. Соединений на воркере тысячи, поэтому
+    атрибуты заданы через ``__slots__``.
+
+    В очередь кладутся ``Frame``: сообщение кодируется в протокол соединения
+    (JSON или MessagePack) при отправке, один раз на протокол для всех
+    соединений.
+    ``put`` не блокируется: медленный клиент копит сообщения только в своей
+    очереди, а при ее переполнении срабатывает ``policy``.
+
+    :param ws: ``aiohttp.web.WebSocketResponse`` после ``prepare``
+    :param user: ник пользователя
+    :param maxsize: размер очереди
+    :param policy: одна из ``POLICIES``
+    :param compress_min_size: если клиент согласовал permessage-deflate,
+        сообщения короче стольких символов уходят без сжатия
+    """
+
+    __slots__ = (
+        'ws', 'user', 'maxsize', 'policy', 'compress_min_size', 'binary',
+        'connected_at', 'last_seen', 'received', 'sent', 'dropped', 'close_code', 'close_message',
+        '_queue', '_wakeup', '_flushed', '_closing', '_task',
+    )
+
+    def __init__(self, ws: web.WebSocketResponse, user: str, maxsize: int, policy: str,
+                 compress_min_size: int = 0):
+        self.ws = ws
+        self.user = user
+        self.maxsize = maxsize
+        self.policy = policy
+        self.compress_min_size = compress_min_size
+        # Подпротокол согласован в WebSocketResponse.prepare
+        self.binary = getattr(ws, 'ws_protocol', None) == MSGPACK_PROTOCOL
+        self.connected_at = time.time()
+        # Время последнего входящего фрейма, по нему ``Reaper`` находит простаивающих
+        self.last_seen = time.monotonic()
+        # Входящие, отправленные и отброшенные из-за переполнения очереди сообщения
+        self.received = 0
+        self.sent = 0
+        self.dropped = 0
+        # С каким кодом закрывать сокет. Закрытие в фоне может опередить
+        # обработчик соединения, и он закрывает сокет с тем же кодом
+        self.close_code = WSCloseCode.OK
+        self.close_message = b''
+
+        self._queue = collections.deque()
+        self._wakeup = asyncio.Event()
+        # Установлен, пока очередь пуста и отправлять нечего
+        self._flushed = asyncio.Event()
+        self._closing = False
+        self._task = asyncio.ensure_future(self._writer())
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    @property
+    def closing(self) -> bool:
+        return self._closing
+
+    def put(self, message: Frame) -> bool:
+        """ Ставит сообщение в очередь. ``False``, если сообщение не принято. """
+        if self._closing:
+            return False
+
+        if len(self._queue) >= self.maxsize:
+            self.dropped += 1
+            MESSAGES_DROPPED.inc()
+
+            if self.policy == DROP_NEWEST:
+                return False
+
+            if self.policy == DISCONNECT:
+                self.close(WSCloseCode.POLICY_VIOLATION, b'slow consumer')
+                return False
+
+            self._queue.popleft()
+
+        self._queue.append(message)
+        self._wakeup.set()
+        self._flushed.clear()
+        return True
+
+    def close(self, code: int = WSCloseCode.OK, message: bytes = b'') -> None:
+        """ Останавливает отправку и закрывает сокет в фоне. """
+        if self._closing:
+            return
+
+        self.close_code = code
+        self.close_message = message
+        self.stop()
+        asyncio.ensure_future(self.ws.close(code=code, message=message))
+
+    def stop(self) -> None:
+        """ Останавливает отправку, сокет не закрывается. Новые сообщения не принимаются. """
+        self._closing = True
+        self._queue.clear()
+        # Отправлять больше нечего: flush не должен ждать
+        self._flushed.set()
+        self._task.cancel()
+
+    async def flush(self) -> None:
+        """ Ждет, пока очередь будет отправлена. """
+        await self._flushed.wait()
+
+    async def _writer(self):
+        queue = self._queue
+        # aiohttp сжимает либо все сообщения, либо ни одного: порог задаем,
+        # переключая согласованный wbits у writer перед каждой отправкой
+        writer = getattr(self.ws, '_writer', None)
+        compress = getattr(writer, 'compress', 0) if self.compress_min_size else 0
+
+        try:
+            while True:
+                if not queue:
+                    self._flushed.set()
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                frame = queue.popleft()
+                payload = frame.msgpack if self.binary else frame.json
+                if compress:
+                    writer.compress = compress if len(payload) >= self.compress_min_size else 0
+
+                if self.binary:
+                    await self.ws.send_bytes(payload)
+                else:
+                    await self.ws.send_str(payload)
+                self.sent += 1
+                MESSAGES_OUT.inc()
+
+        except asyncio.CancelledError:
+            raise
+
+        except ConnectionResetError:
+            logger.info(f'Connection of {self.user} reset')
+            self.close()
+
+        except Exception:
+            # Например, RuntimeError закрывающегося транспорта: соединение больше не получает рассылку
+            logger.exception(f'Failed to send to {self.user}, closing the connection')
+            self.close(WSCloseCode.INTERNAL_ERROR, b'send failed')
+
+
+class FanOut:
+    """
+    Рассылка сообщений подключенным пользователям.
+
+    ``broadcast`` только раскладывает сообщение по очередям соединений,
+    отправкой занимаются задачи ``Sender``.
+
+    Если задано ``coalesce_window``, сообщения копятся до ``coalesce_window``
+    секунд (или до ``coalesce_max_batch`` штук) и уходят одним фреймом -
+    массивом (``BatchFrame``). Одиночное сообщение уходит как есть. Массив
+    собирается один раз на всех получателей каждого протокола.
+
+    :param maxsize: размер исходящей очереди каждого соединения
+    :param policy: политика для переполненной очереди, одна из ``POLICIES``
+    :param coalesce_window: окно склейки, сек., 0 - без склейки
+    :param coalesce_max_batch: максимум сообщений в одном фрейме
+    :param compress_min_size: порог сжатия сообщений, символов (см. ``Sender``)
+    """
+
+    def __init__(self, maxsize: int, policy: str, coalesce_window: float = 0, coalesce_max_batch: int = 100,
+                 compress_min_size: int = 0):
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown slow consumer policy: {policy}')
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.coalesce_window = coalesce_window
+        self.coalesce_max_batch = coalesce_max_batch
+        self.compress_min_size = compress_min_size
+        self._senders = ConnectionRegistry()
+
+        self._pending: List[Frame] = []
+        self._pending_since = 0.0
+        self._flush_handle = None
+        # Комната закрывается при остановке воркера: рассылка больше не нужна
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self._senders)
+
+    def __iter__(self) -> Iterator[Sender]:
+        # Без копии: соединения не добавляются и не удаляются во время обхода
+        return iter(self._senders)
+
+    def register(self, user: str, ws: web.WebSocketResponse) -> Sender:
+        """ Новая сессия пользователя. Прежние сессии того же ника продолжают работать. """
+        # Накопленное уже попало в историю, которую получит новое соединение
+        self.flush()
+
+        sender = Sender(ws, user, maxsize=self.maxsize, policy=self.policy,
+                        compress_min_size=self.compress_min_size)
+        self._senders.add(sender)
+        return sender
+
+    def unregister(self, sender: Sender) -> None:
+        sender.stop()
+        self._senders.remove(sender)
+
+    def broadcast(self, message: Frame) -> None:
+        if self._closed:
+            return
+
+        if not self.coalesce_window:
+            self._send(message)
+            return
+
+        if not self._pending:
+            self._pending_since = time.monotonic()
+            self._flush_handle = asyncio.get_event_loop().call_later(self.coalesce_window, self.flush)
+
+        self._pending.append(message)
+        if len(self._pending) >= self.coalesce_max_batch:
+            self.flush()
+
+    def close(self) -> None:
+        """
+        Отправляет накопленное и прекращает рассылку. Очереди соединений
+        остаются: в них еще можно положить сообщение через ``Sender.put``.
+        """
+        self.flush()
+        self._closed = True
+
+    def flush(self) -> None:
+        """ Отправляет накопленные сообщения одним фреймом. """
+        if not self._pending:
+            return
+
+        self._flush_handle.cancel()
+        self._flush_handle = None
+        pending, self._pending = self._pending, []
+
+        COALESCE_BATCH_SIZE.observe(len(pending))
+        COALESCE_DELAY_SECONDS.observe(time.monotonic() - self._pending_since)
+        self._send(pending[0] if len(pending) == 1 else BatchFrame(pending))
+
+    def _send(self, message: Frame) -> None:
+        # put не меняет реестр, поэтому копия для итерации не нужна
+        for sender in self._senders:
+            sender.put(message)
@@ -0,0 +1,229 @@
+import collections
+import datetime
+import itertools
+from typing import List, Optional, Tuple
+
+from chat.services.encoders import Frame
+from chat.services.metrics import HISTORY_HITS, HISTORY_MISSES
+from chat.services.singleflight import SingleFlight
+from chat.services.statements import get_last_chat_messages, get_chat_messages_after
+from chat.services.utils import time_to_str
+from config.settings import CHAT_DEFAULT_ROOM
+
+
+class HistoryMessage:
+    """ Сообщение чата в памяти: только поля, которые уходят клиентам. """
+
+    __slots__ = ('id', 'nickname', 'text', 'created_date', 'room', '_frame')
+
+    def __init__(self, id: Optional[int], nickname: str, text: str, created_date: datetime.datetime,
+                 room: str = CHAT_DEFAULT_ROOM):
+        self.id = id
+        self.nickname = nickname
+        self.text = text
+        self.created_date = created_date
+        self.room = room
+        self._frame = None
+
+    @classmethod
+    def from_record(cls, record) -> 'HistoryMessage':
+        """ Из записи ``chat.services.statements``: колонки идут в порядке аргументов. """
+        return cls(*record)
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'text': self.text,
+            'user': self.nickname,
+            'time': time_to_str(self.created_date),
+        }
+
+    @property
+    def frame(self) -> Frame:
+        """ Фрейм сообщения. Создается один раз и переиспользуется вместе с кодировками. """
+        if self._frame is None:
+            self._frame = Frame(self.to_dict())
+        return self._frame
+
+
+class MessageHistory:
+    """
+    Кольцевой буфер последних сообщений комнаты.
+
+    Держит не больше ``capacity`` сообщений и не больше ``max_chars`` символов
+    текста суммарно: при переполнении вытесняются самые старые сообщения.
+    Буфер прогревается из БД один раз при первом подключении к комнате,
+    дальше все новые сообщения пишутся в него, и история при подключении
+    отдается из памяти.
+
+    Если история все же берется из БД, одинаковые запросы подключающихся
+    одновременно клиентов выполняются один раз (``SingleFlight``), а
+    результат еще ``cache_ttl`` секунд отдается без запроса. Сообщения,
+    которые пришли после запроса, каждый вызов добирает из буфера.
+
+    :param room: комната
+    :param capacity: максимальное количество сообщений
+    :param max_chars: максимальный суммарный размер текста сообщений
+    :param cache_ttl: сколько секунд переиспользовать результат запроса к БД
+    """
+
+    def __init__(self, room: str, capacity: int, max_chars: int, cache_ttl: float = 0):
+        self.room = room
+        self.capacity = capacity
+        self.max_chars = max_chars
+        self.warmed = False
+        self.hits = 0
+        self.misses = 0
+
+        self._messages = collections.deque()
+        self._chars = 0
+        # В буфере есть не все сегодняшние сообщения
+        self._truncated = False
+        self._loads = SingleFlight(cache_ttl)
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    @property
+    def chars(self) -> int:
+        return self._chars
+
+    def append(self, message: HistoryMessage) -> None:
+        self._messages.append(message)
+        self._chars += len(message.text)
+
+        while len(self._messages) > self.capacity or \
+                (self._chars > self.max_chars and len(self._messages) > 1):
+            old = self._messages.popleft()
+            self._chars -= len(old.text)
+            self._truncated = True
+
+    def clear(self) -> None:
+        self._messages.clear()
+        self._chars = 0
+        self._truncated = False
+
+    async def warm_up(self) -> None:
+        """
+        Заполняет буфер последними сообщениями из БД. Сообщения, которые
+        пришли в буфер во время запроса и еще не записаны в БД, остаются.
+        Одновременные вызовы ждут один запрос.
+        """
+        await self._loads.do('warm_up', self._warm_up, ttl=0)
+
+    async def _warm_up(self):
+        messages = await get_last_chat_messages(self.room, limit=self.capacity)
+
+        stored = {mes['id'] for mes in messages}
+        appended = [mes for mes in self._messages if mes.id is None or mes.id not in stored]
+        self.clear()
+        for mes in reversed(messages):
+            self.append(HistoryMessage.from_record(mes))
+        for mes in appended:
+            self.append(mes)
+
+        self._truncated = self._truncated or len(messages) >= self.capacity
+        self.warmed = True
+
+    def last(self, limit: int) -> Optional[List[HistoryMessage]]:
+        """
+        Последние ``limit`` сегодняшних сообщений, от старых к новым.
+
+        Возвращает ``None``, если буфер не может ответить (не прогрет или
+        вытеснил нужные сообщения) и историю надо брать из БД.
+        """
+        if not self.warmed or (self._truncated and len(self._messages) < limit):
+            self.misses += 1
+            HISTORY_MISSES.inc()
+            return None
+
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+
+        result = []
+        for mes in reversed(self._messages):
+            if len(result) >= limit or mes.created_date <= today:
+                break
+            result.append(mes)
+        result.reverse()
+
+        self.hits += 1
+        HISTORY_HITS.inc()
+        return result
+
+    def newer_than(self, date: datetime.datetime) -> List[HistoryMessage]:
+        """ Сообщения буфера новее ``date``, от старых к новым. """
+        result = []
+        for mes in reversed(self._messages):
+            if mes.created_date <= date:
+                break
+            result.append(mes)
+        result.reverse()
+        return result
+
+    async def recent(self, limit: int) -> List[HistoryMessage]:
+        """ Последние ``limit`` сегодняшних сообщений: из буфера, а если он не может ответить - из БД. """
+        messages = self.last(limit)
+        if messages is not None:
+            return messages
+
+        stored = await self._loads.do(('last', limit), lambda: self._load_last(limit))
+
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        after = (stored[-1].created_date, stored[-1].id) if stored else (today, 0)
+        messages = stored + self._newer(after, {mes.id for mes in stored})
+        return messages[-limit:]
+
+    async def _load_last(self, limit: int) -> List[HistoryMessage]:
+        records = await get_last_chat_messages(self.room, limit)
+        return [HistoryMessage.from_record(record) for record in reversed(records)]
+
+    def _newer(self, after: tuple, stored: set) -> List[HistoryMessage]:
+        """ Сообщения буфера после ``after`` = (created_date, id), которых нет среди ``stored``. """
+        messages = [
+            mes for mes in self._messages
+            if mes.id is not None and mes.id not in stored and (mes.created_date, mes.id) > after
+        ]
+        messages.sort(key=lambda mes: (mes.created_date, mes.id))
+        return messages
+
+    async def since(self, message_id: int, limit: int) -> Optional[Tuple[List[HistoryMessage], bool]]:
+        """
+        Сообщения после ``message_id``, от старых к новым, не больше ``limit``
+        самых новых. Возвращает ``(сообщения, complete)``, где ``complete`` -
+        отданы все пропущенные сообщения, или ``None``, если ``message_id``
+        не найден ни в буфере, ни в БД.
+
+        Если сообщение есть в буфере, ответ берется из памяти. Иначе - из БД,
+        к которой добавляются еще не записанные сообщения из буфера.
+        """
+        if self.warmed:
+            for index in range(len(self._messages) - 1, -1, -1):
+                if self._messages[index].id == message_id:
+                    missed = list(itertools.islice(self._messages, index + 1, None))
+                    return missed[-limit:], len(missed) <= limit
+
+        found = await self._loads.do(('since', message_id, limit), lambda: self._load_after(message_id, limit))
+        if found is None:
+            return None
+
+        created_date, stored = found
+        complete = len(stored) < limit
+
+        newer = self._newer((created_date, message_id), {mes.id for mes in stored})
+        if newer:
+            messages = sorted(stored + newer, key=lambda mes: (mes.created_date, mes.id))
+            if len(messages) > limit:
+                messages = messages[-limit:]
+                complete = False
+        else:
+            messages = list(stored)
+
+        return messages, complete
+
+    async def _load_after(self, message_id: int, limit: int) -> Optional[Tuple[datetime.datetime, list]]:
+        found = await get_chat_messages_after(self.room, message_id, limit)
+        if found is None:
+            return None
+
+        created_date, records = found
+        return created_date, [HistoryMessage.from_record(record) for record in reversed(records)]
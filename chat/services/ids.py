@@ -0,0 +1,56 @@
+import asyncio
+import collections
+from typing import Optional
+
+from loguru import logger
+
+from chat.services.statements import reserve_message_ids
+
+
+class IdAllocator:
+    """
+    Выдает id сообщений заранее, до их записи в БД.
+
+    Id берутся из последовательности таблицы блоками по ``block_size``, поэтому
+    они уникальны между воркерами и почти всегда выдаются без обращения к БД:
+    новый блок запрашивается в фоне, когда от текущего остается половина.
+    Id не монотонны по времени между воркерами: порядок сообщений задает
+    (created_date, id).
+
+    ``next`` никогда не ждет БД: если блок кончился (или БД недоступна), он
+    запускает пополнение в фоне и возвращает ``None`` - сообщение все равно
+    рассылается, а id получит при записи.
+
+    :param block_size: сколько id резервировать за один запрос
+    """
+
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self._ids = collections.deque()
+        self._refill = None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def next(self) -> Optional[int]:
+        if not self._ids:
+            self.refill()
+            return None
+
+        message_id = self._ids.popleft()
+        if len(self._ids) < self.block_size // 2:
+            self.refill()
+        return message_id
+
+    def refill(self) -> None:
+        """ Запускает резервирование нового блока в фоне, если оно еще не идет. """
+        if self._refill is None:
+            self._refill = asyncio.ensure_future(self._reserve())
+
+    async def _reserve(self):
+        try:
+            self._ids.extend(await reserve_message_ids(self.block_size))
+        except Exception as e:
+            logger.warning(f'Failed to reserve message ids: {e!r}')
+        finally:
+            self._refill = None
@@ -0,0 +1,43 @@
+import contextlib
+import time
+
+from config.settings import CHAT_ENGINE as db
+from utils.metrics import REGISTRY
+
+CONNECTIONS = REGISTRY.gauge('chat_connections', 'Active WebSocket connections')
+CONNECTIONS_REJECTED = REGISTRY.counter('chat_connections_rejected_total', 'WebSocket upgrades rejected by the connection cap')
+CONNECTIONS_REAPED = REGISTRY.counter('chat_connections_reaped_total', 'Dead or idle WebSocket connections closed by the reaper')
+ROOMS = REGISTRY.gauge('chat_rooms', 'Rooms in memory')
+
+MESSAGES_IN = REGISTRY.counter('chat_messages_in_total', 'Chat messages received from clients')
+MESSAGES_OUT = REGISTRY.counter('chat_messages_out_total', 'Frames sent to clients')
+MESSAGES_THROTTLED = REGISTRY.counter('chat_messages_throttled_total', 'Inbound messages rejected by the rate limiter')
+MESSAGES_DROPPED = REGISTRY.counter('chat_messages_dropped_total', 'Frames dropped by the slow consumer policy')
+
+COALESCE_DELAY_SECONDS = REGISTRY.histogram(
+    'chat_coalesce_delay_seconds', 'Delay added by the coalescing window to the oldest message of a frame')
+COALESCE_BATCH_SIZE = REGISTRY.histogram(
+    'chat_coalesce_batch_size', 'Messages per coalesced frame', buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+BROADCAST_SECONDS = REGISTRY.histogram('chat_broadcast_seconds', 'Time to fan out one message to a room')
+HISTORY_LOAD_SECONDS = REGISTRY.histogram('chat_history_load_seconds', 'Time to load join history')
+HISTORY_HITS = REGISTRY.counter('chat_history_hits_total', 'Join history served from memory')
+HISTORY_MISSES = REGISTRY.counter('chat_history_misses_total', 'Join history loaded from the DB')
+HISTORY_LOADS_SHARED = REGISTRY.counter(
+    'chat_history_loads_shared_total', 'History loads served by an in-flight or recent identical DB query')
+
+PERSIST_SECONDS = REGISTRY.histogram('chat_persist_seconds', 'Time to insert one batch of messages')
+PERSIST_MESSAGES = REGISTRY.counter('chat_persist_messages_total', 'Messages written to the DB')
+
+DB_POOL_SIZE = REGISTRY.gauge('db_pool_size', 'Open connections in the DB pool')
+DB_POOL_IDLE = REGISTRY.gauge('db_pool_idle', 'Idle connections in the DB pool')
+DB_POOL_WAITERS = REGISTRY.gauge('db_pool_waiters', 'Coroutines waiting for a DB pool connection')
+DB_POOL_ACQUIRE_SECONDS = REGISTRY.histogram('db_pool_acquire_seconds', 'Time waiting for a DB pool connection')
+
+
+@contextlib.asynccontextmanager
+async def acquire():
+    """ Соединение из пула с замером времени ожидания. """
+    start = time.perf_counter()
+    async with db.acquire() as conn:
+        DB_POOL_ACQUIRE_SECONDS.observe(time.perf_counter() - start)
+        yield conn
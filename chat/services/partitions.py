@@ -0,0 +1,124 @@
+import datetime
+from typing import List, Tuple
+
+import asyncpg
+from loguru import logger
+
+from config.settings import CHAT_ENGINE as db
+
+TABLE = 'chat_message'
+PARTITION_PREFIX = f'{TABLE}_p'
+
+# --- Что делать со старыми партициями
+DROP = 'drop'
+DETACH = 'detach'
+
+# Ключ advisory lock обслуживания партиций: его задачу запускает каждый воркер
+MAINTENANCE_LOCK = 0x63686174
+
+
+def partition_name(day: datetime.date) -> str:
+    return f'{PARTITION_PREFIX}{day:%Y%m%d}'
+
+
+def partition_day(name: str) -> datetime.date:
+    return datetime.datetime.strptime(name[len(PARTITION_PREFIX):], '%Y%m%d').date()
+
+
+async def list_partitions() -> List[Tuple[str, datetime.date]]:
+    """ Партиции таблицы сообщений по возрастанию дня. """
+    rows = await db.all(
+        db.text(
+            """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = :table AND child.relname LIKE :prefix
+            ORDER BY child.relname
+            """
+        ),
+        table=TABLE, prefix=f'{PARTITION_PREFIX}%',
+    )
+    return [(row[0], partition_day(row[0])) for row in rows]
+
+
+async def create_partitions(days_ahead: int, today: datetime.date = None) -> List[str]:
+    """ Создает недостающие партиции с сегодняшнего дня на ``days_ahead`` дней вперед. """
+    today = today or datetime.date.today()
+    existing = {name for name, _ in await list_partitions()}
+
+    created = []
+    for offset in range(days_ahead + 1):
+        day = today + datetime.timedelta(days=offset)
+        name = partition_name(day)
+        if name in existing:
+            continue
+
+        try:
+            await db.status(
+                f'CREATE TABLE "{name}" PARTITION OF {TABLE} '
+                f"FOR VALUES FROM ('{day}') TO ('{day + datetime.timedelta(days=1)}')"
+            )
+        except asyncpg.exceptions.DuplicateTableError:
+            # Партицию успел создать другой воркер
+            continue
+
+        created.append(name)
+
+    return created
+
+
+async def retire_partitions(keep_days: int, mode: str = DROP, today: datetime.date = None) -> List[str]:
+    """
+    Убирает партиции старше ``keep_days`` дней (сегодняшний день считается).
+    Удаление или отсоединение партиции - операция над метаданными,
+    в отличие от DELETE она не оставляет мертвых строк для VACUUM.
+
+    :param mode: ``DROP`` - удалить, ``DETACH`` - отсоединить и оставить таблицу, например для архива
+    """
+    if mode not in (DROP, DETACH):
+        raise ValueError(f'Unknown partition retire mode: {mode}')
+
+    today = today or datetime.date.today()
+    oldest = today - datetime.timedelta(days=max(keep_days, 1) - 1)
+
+    retired = []
+    for name, day in await list_partitions():
+        if day >= oldest:
+            break
+
+        try:
+            if mode == DROP:
+                await db.status(f'DROP TABLE IF EXISTS "{name}"')
+            else:
+                await db.status(f'ALTER TABLE {TABLE} DETACH PARTITION "{name}"')
+        except asyncpg.exceptions.UndefinedTableError:
+            # Партицию успел убрать другой воркер
+            continue
+
+        retired.append(name)
+
+    return retired
+
+
+async def maintain_partitions(days_ahead: int, keep_days: int, mode: str = DROP) -> bool:
+    """
+    Создает партиции вперед и убирает старые. Одновременно обслуживанием
+    занимается один воркер, остальные его пропускают.
+
+    :return: было ли обслуживание выполнено этим воркером
+    """
+    async with db.acquire() as conn:
+        if not await conn.scalar(db.text('SELECT pg_try_advisory_lock(:key)'), key=MAINTENANCE_LOCK):
+            logger.info('Partitions are maintained by another worker')
+            return False
+
+        try:
+            created = await create_partitions(days_ahead)
+            retired = await retire_partitions(keep_days, mode=mode)
+        finally:
+            await conn.scalar(db.text('SELECT pg_advisory_unlock(:key)'), key=MAINTENANCE_LOCK)
+
+    logger.info(f'Partitions created: {created}, {mode}: {retired}')
+    return True
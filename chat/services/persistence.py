@@ -0,0 +1,141 @@
+import asyncio
+import collections
+import time
+from typing import List
+
+import asyncpg
+from loguru import logger
+
+from chat.services.history import HistoryMessage
+from chat.services.metrics import PERSIST_SECONDS, PERSIST_MESSAGES, acquire
+from chat.services.statements import create_chat_messages
+
+# Ошибки, после которых запись имеет смысл повторить: БД временно недоступна
+RETRY_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.InterfaceError,
+    asyncpg.exceptions.OperatorInterventionError,
+    asyncpg.exceptions.InsufficientResourcesError,
+)
+
+
+class MessagePersister:
+    """
+    Отложенная пакетная запись сообщений в БД (write-behind).
+
+    Сообщения сначала рассылаются, а в БД попадают пачками: одним
+    INSERT, как только накопится ``batch_size`` сообщений или
+    пройдет ``flush_interval`` секунд. Если БД временно недоступна, пачка
+    пишется повторно с экспоненциальной задержкой, а новые сообщения копятся
+    в буфере размером не больше ``max_pending`` (при переполнении теряются
+    самые старые). Если пачку отвергла сама БД (например, слишком длинное
+    значение), она пишется по одному сообщению, и теряются только плохие.
+    ``stop`` дописывает буфер перед остановкой.
+
+    :param batch_size: максимальный размер одной пачки
+    :param flush_interval: как часто сбрасывать неполную пачку, сек.
+    :param max_pending: максимальный размер буфера
+    :param retry_delay: начальная задержка повтора, сек.
+    :param max_retry_delay: максимальная задержка повтора, сек.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_pending: int,
+                 retry_delay: float, max_retry_delay: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self.written = 0
+        self.dropped = 0
+        self.failures = 0
+
+        self._pending = collections.deque()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+    def add(self, message: HistoryMessage) -> None:
+        if len(self._pending) >= self.max_pending:
+            self._pending.popleft()
+            self.dropped += 1
+            logger.error('Persist buffer is full, the oldest message is dropped')
+
+        self._pending.append(message)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def stop(self, timeout: float) -> None:
+        """ Дописывает буфер и останавливает задачу, но не дольше ``timeout`` секунд. """
+        if self._task is None:
+            return
+
+        self._stopping = True
+        self._wakeup.set()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error(f'Persist buffer was not drained, {len(self._pending)} messages lost')
+            self._task.cancel()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self._wakeup.clear()
+            await self._flush()
+
+        await self._flush()
+
+    async def _flush(self):
+        pending = self._pending
+
+        while pending:
+            batch = [pending.popleft() for _ in range(min(self.batch_size, len(pending)))]
+            await self._write(batch)
+
+    async def _write(self, batch: List[HistoryMessage]):
+        delay = self.retry_delay
+
+        while True:
+            try:
+                async with acquire() as conn:
+                    start = time.perf_counter()
+                    await create_chat_messages(batch, bind=conn)
+                    PERSIST_SECONDS.observe(time.perf_counter() - start)
+
+            except RETRY_ERRORS as e:
+                self.failures += 1
+                logger.warning(f'Failed to persist {len(batch)} messages, retry in {delay}s: {e!r}')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+
+            except Exception:
+                self.failures += 1
+                if len(batch) > 1:
+                    logger.exception(f'Failed to persist {len(batch)} messages, writing them one by one')
+                    for mes in batch:
+                        await self._write([mes])
+                    return
+
+                self.dropped += 1
+                logger.exception(f'Failed to persist a message of {batch[0].nickname}, it is dropped')
+                return
+
+            else:
+                self.written += len(batch)
+                PERSIST_MESSAGES.inc(len(batch))
+                return
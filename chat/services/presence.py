@@ -0,0 +1,112 @@
+from typing import Dict, List, Optional
+
+# --- Типы событий присутствия
+PRESENCE = 'presence'
+JOIN = 'join'
+LEAVE = 'leave'
+
+
+class Presence:
+    """
+    Список пользователей в чате с номером версии.
+
+    Полный список отправляется только при подключении (``snapshot``), дальше
+    клиенты получают события ``join``/``leave``. Каждое событие увеличивает
+    ``version`` на единицу: если клиент видит скачок версии, значит он
+    пропустил событие и должен переподключиться за новым снимком.
+
+    Один ник может быть подключен несколько раз и к разным воркерам: сессии
+    считаются по узлам (``node=None`` - текущий процесс). Событие ``join``
+    уходит при первой сессии ника, ``leave`` - при закрытии последней.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._sessions: Dict[str, int] = {}
+        self._nodes: Dict[Optional[str], Dict[str, int]] = {None: {}}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, user: str) -> bool:
+        return user in self._sessions
+
+    @property
+    def users(self) -> List[str]:
+        return list(self._sessions)
+
+    @property
+    def local_sessions(self) -> Dict[str, int]:
+        """ Сессии текущего процесса: ник -> количество. """
+        return dict(self._nodes[None])
+
+    def join(self, user: str, node: str = None) -> Optional[dict]:
+        """ Регистрирует сессию. Возвращает событие, если пользователь только что зашел. """
+        sessions = self._nodes.setdefault(node, {})
+        sessions[user] = sessions.get(user, 0) + 1
+
+        return self._change(user, 1)
+
+    def leave(self, user: str, node: str = None) -> Optional[dict]:
+        """ Снимает сессию. Возвращает событие, если это была последняя сессия. """
+        sessions = self._nodes.get(node, {})
+        count = sessions.get(user)
+        if not count:
+            return None
+
+        if count > 1:
+            sessions[user] = count - 1
+        else:
+            del sessions[user]
+
+        return self._change(user, -1)
+
+    def sync_node(self, node: str, sessions: Dict[str, int]) -> List[dict]:
+        """ Заменяет сессии узла ``node`` на ``sessions``. Возвращает события. """
+        old = self._nodes.pop(node, {})
+        if sessions:
+            self._nodes[node] = dict(sessions)
+
+        events = []
+        for user in old.keys() | sessions.keys():
+            event = self._change(user, sessions.get(user, 0) - old.get(user, 0))
+            if event is not None:
+                events.append(event)
+
+        return events
+
+    def drop_node(self, node: str) -> List[dict]:
+        """ Узел остановился: все его сессии закрыты. """
+        return self.sync_node(node, {})
+
+    def snapshot(self) -> dict:
+        return {
+            'type': PRESENCE,
+            'users': self.users,
+            'version': self.version,
+        }
+
+    def _change(self, user: str, delta: int) -> Optional[dict]:
+        before = self._sessions.get(user, 0)
+        after = before + delta
+
+        if after > 0:
+            self._sessions[user] = after
+        else:
+            self._sessions.pop(user, None)
+
+        if not before and after > 0:
+            return self._event(JOIN, user)
+
+        if before and after <= 0:
+            return self._event(LEAVE, user)
+
+        return None
+
+    def _event(self, type_: str, user: str) -> dict:
+        self.version += 1
+        return {
+            'type': type_,
+            'user': user,
+            'version': self.version,
+        }
@@ -3,12 +3,12 @@ from typing import Type
 from sqlalchemy.sql.selectable import Select
 
 from config.models.chat_models import ChatMessage
-from config.settings import CHAT_ENGINE as db
+from config.settings import CHAT_ENGINE as db, CHAT_HISTORY_LIMIT, CHAT_DEFAULT_ROOM
 
 
-def create_chat_message_queryset(nickname: str, text: str) -> Type[Select]:
+def create_chat_message_queryset(nickname: str, text: str, room: str = CHAT_DEFAULT_ROOM) -> Type[Select]:
 
-    return ChatMessage.create(nickname=nickname, text=text, created_date=datetime.datetime.now())
+    return ChatMessage.create(nickname=nickname, text=text, room=room, created_date=datetime.datetime.now())
 
 
 def get_all_chat_message_queryset() -> Type[Select]:
@@ -18,6 +18,14 @@ def get_all_chat_message_queryset() -> Type[Select]:
         .order_by(ChatMessage.created_date)
 
 
-def del_old_chat_message_queryset() -> Type[Select]:
+def get_last_chat_message_queryset(room: str = CHAT_DEFAULT_ROOM, limit: int = CHAT_HISTORY_LIMIT) -> Type[Select]:
+    """
+    Последние ``limit`` сообщений комнаты за сегодня, от новых к старым.
+    Сортировка и LIMIT выполняются в БД по индексу (room, created_date, id).
+    """
+    return ChatMessage.select('id', 'room', 'nickname', 'created_date', 'text') \
+        .where(ChatMessage.room == room) \
+        .where(ChatMessage.created_date > db.func.current_date()) \
+        .order_by(ChatMessage.created_date.desc(), ChatMessage.id.desc()) \
+        .limit(limit)
 
-    return ChatMessage.delete.where(ChatMessage.created_date < db.func.current_date())
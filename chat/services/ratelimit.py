@@ -0,0 +1,78 @@
+import time
+from typing import Dict, Optional
+
+# --- Что делать с сообщением сверх лимита
+THROTTLE = 'throttle'
+DISCONNECT = 'disconnect'
+
+POLICIES = (THROTTLE, DISCONNECT)
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    """
+    Ограничение входящих сообщений по алгоритму token bucket.
+
+    У каждого ключа (ника) свое ведро на ``burst`` токенов, которое
+    пополняется со скоростью ``rate`` токенов в секунду; сообщение забирает
+    один токен. Пополнение считается лениво при проверке, поэтому проверка -
+    O(1) без таймеров на пользователя. Полное ведро ничем не отличается
+    от нового, и ``prune`` периодически удаляет такие ведра.
+
+    :param rate: токенов в секунду
+    :param burst: емкость ведра
+    :param policy: что делать с сообщением сверх лимита, одна из ``POLICIES``
+    """
+
+    def __init__(self, rate: float, burst: int, policy: str):
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown rate limit policy: {policy}')
+
+        self.rate = rate
+        self.burst = burst
+        self.policy = policy
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def acquire(self, key: str, now: Optional[float] = None) -> float:
+        """
+        Забирает токен. Возвращает 0, если сообщение можно принять,
+        иначе - через сколько секунд появится следующий токен.
+        """
+        if now is None:
+            now = time.monotonic()
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.burst, now)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0
+
+        return (1 - bucket.tokens) / self.rate
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """ Удаляет ведра, которые уже пополнились до конца. """
+        if now is None:
+            now = time.monotonic()
+
+        full = [
+            key for key, bucket in self._buckets.items()
+            if bucket.tokens + (now - bucket.updated) * self.rate >= self.burst
+        ]
+        for key in full:
+            del self._buckets[key]
+        return len(full)
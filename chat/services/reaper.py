@@ -0,0 +1,82 @@
+import asyncio
+import time
+from typing import Optional
+
+from aiohttp import WSCloseCode
+from loguru import logger
+
+from chat.services.metrics import CONNECTIONS_REAPED
+from chat.services.ratelimit import RateLimiter
+from chat.services.rooms import RoomRegistry
+
+
+class Reaper:
+    """
+    Периодически закрывает соединения, которые только занимают место в рассылке.
+
+    Мертвым считается соединение, у которого сокет уже закрыт или пропал
+    транспорт (например, heartbeat не дождался pong), а простаивающим -
+    соединение без входящих фреймов дольше ``idle_timeout`` секунд. Pong
+    на heartbeat aiohttp обрабатывает сам, поэтому клиент, который только
+    читает, тоже простаивает: ``idle_timeout`` по умолчанию выключен.
+    Закрытие сокета завершает цикл чтения в ``WebSocket.get``, и он сам
+    убирает соединение из комнаты.
+
+    :param rooms: реестр комнат
+    :param interval: период проверки, сек.
+    :param idle_timeout: время простоя, сек., 0 - не закрывать простаивающих
+    :param limiter: заодно чистит от полных ведер
+    """
+
+    def __init__(self, rooms: RoomRegistry, interval: float, idle_timeout: float,
+                 limiter: Optional[RateLimiter] = None):
+        self.rooms = rooms
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.limiter = limiter
+        self._task = None
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.reap()
+                if self.limiter is not None:
+                    self.limiter.prune()
+            except Exception:
+                logger.exception('Reaper failed')
+
+    def reap(self) -> int:
+        """ Один проход по всем соединениям. Возвращает количество закрытых. """
+        now = time.monotonic()
+        reaped = 0
+
+        for room in list(self.rooms):
+            for sender in room.fanout:
+                if sender.closing:
+                    continue
+
+                ws = sender.ws
+                # aiohttp не отдает состояние транспорта публично
+                request = getattr(ws, '_req', None)
+                if ws.closed or (request is not None and request.transport is None):
+                    sender.close(WSCloseCode.GOING_AWAY, b'dead connection')
+                elif self.idle_timeout and now - sender.last_seen > self.idle_timeout:
+                    sender.close(WSCloseCode.GOING_AWAY, b'idle timeout')
+                else:
+                    continue
+
+                reaped += 1
+
+        if reaped:
+            CONNECTIONS_REAPED.inc(reaped)
+            logger.info(f'Reaped {reaped} connections')
+        return reaped
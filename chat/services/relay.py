@@ -0,0 +1,158 @@
+import asyncio
+import datetime
+import time
+from typing import Dict, Iterable, Optional
+
+from aiohttp import web
+from loguru import logger
+
+from chat.services.backplane import Backplane
+from chat.services.encoders import Frame
+from chat.services.history import HistoryMessage
+from chat.services.presence import JOIN, LEAVE
+from chat.services.rooms import Room
+
+# --- Виды событий шины
+MESSAGE = 'message'
+# Узел запустился и просит остальных прислать свои сессии
+HELLO = 'hello'
+# Сессии узла: ответ на HELLO и периодический heartbeat
+STATE = 'state'
+BYE = 'bye'
+
+
+class Relay:
+    """
+    Связывает чат текущего процесса с шиной (``Backplane``).
+
+    Локальные сообщения и вход/выход пользователей публикуются в шину,
+    а события других узлов раздаются локальным соединениям своей комнаты.
+    Сообщения других узлов только попадают в буфер истории и рассылаются:
+    в БД их пишет узел, на котором они появились. Сообщения для комнат,
+    в которых на этом узле никого нет, пропускаются.
+
+    Каждые ``heartbeat`` секунд узел публикует свои сессии (``STATE``).
+    Узел, от которого ничего не было дольше ``node_timeout`` секунд, считается
+    упавшим без ``BYE``: его пользователи выходят из всех комнат.
+
+    :param heartbeat: период публикации своих сессий, сек.
+    :param node_timeout: через сколько секунд тишины узел считается упавшим
+    """
+
+    def __init__(self, app: web.Application, backplane: Backplane, heartbeat: float = 10,
+                 node_timeout: float = 30):
+        self.app = app
+        self.backplane = backplane
+        self.heartbeat = heartbeat
+        self.node_timeout = node_timeout
+        # Узел -> время последнего события от него
+        self._nodes: Dict[str, float] = {}
+        self._task = None
+
+    async def start(self) -> None:
+        await self.backplane.start(self.on_event, on_reconnect=self.resync)
+        self.backplane.publish(HELLO, {})
+        self._task = asyncio.ensure_future(self._run())
+
+    def resync(self) -> None:
+        """ После переподключения к шине: события за время разрыва потеряны, сессии узлов надо запросить заново. """
+        self.backplane.publish(HELLO, {})
+        self.publish_state()
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        self.backplane.publish(BYE, {})
+        await self.backplane.stop()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                self.publish_state()
+                self.expire()
+            except Exception:
+                logger.exception('Relay heartbeat failed')
+
+    def publish_state(self) -> None:
+        sessions = {room.name: room.presence.local_sessions for room in self.app.rooms}
+        self.backplane.publish(STATE, {'rooms': {name: s for name, s in sessions.items() if s}})
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """ Убирает пользователей узлов, молчащих дольше ``node_timeout``. Возвращает число таких узлов. """
+        if now is None:
+            now = time.monotonic()
+
+        silent = [node for node, seen in self._nodes.items() if now - seen > self.node_timeout]
+        for node in silent:
+            logger.warning(f'Backplane node {node} is silent for {self.node_timeout}s, dropping its sessions')
+            self.drop_node(node)
+        return len(silent)
+
+    def drop_node(self, node: str) -> None:
+        self._nodes.pop(node, None)
+        rooms = self.app.rooms
+        for room in list(rooms):
+            self._broadcast_events(room, room.presence.drop_node(node))
+            rooms.collect(room)
+
+    def publish_message(self, mes: HistoryMessage) -> None:
+        self.backplane.publish(MESSAGE, {
+            'id': mes.id,
+            'room': mes.room,
+            'user': mes.nickname,
+            'text': mes.text,
+            'created_date': mes.created_date.isoformat(),
+        })
+
+    def publish_join(self, room: str, user: str) -> None:
+        self.backplane.publish(JOIN, {'room': room, 'user': user})
+
+    def publish_leave(self, room: str, user: str) -> None:
+        self.backplane.publish(LEAVE, {'room': room, 'user': user})
+
+    def on_event(self, node: str, kind: str, data: dict) -> None:
+        rooms = self.app.rooms
+        self._nodes[node] = time.monotonic()
+
+        if kind == MESSAGE:
+            room = rooms.get(data['room'])
+            if room is None:
+                return
+
+            mes = HistoryMessage(
+                data.get('id'), data['user'], data['text'], datetime.datetime.fromisoformat(data['created_date']), room.name
+            )
+            room.history.append(mes)
+            room.fanout.broadcast(mes.frame)
+
+        elif kind == JOIN:
+            room = rooms.ensure(data['room'])
+            self._broadcast_events(room, [room.presence.join(data['user'], node=node)])
+
+        elif kind == LEAVE:
+            room = rooms.get(data['room'])
+            if room is not None:
+                self._broadcast_events(room, [room.presence.leave(data['user'], node=node)])
+                rooms.collect(room)
+
+        elif kind == HELLO:
+            self.publish_state()
+
+        elif kind == STATE:
+            for name in data['rooms'].keys() - {room.name for room in rooms}:
+                rooms.ensure(name)
+
+            for room in list(rooms):
+                self._broadcast_events(room, room.presence.sync_node(node, data['rooms'].get(room.name, {})))
+                rooms.collect(room)
+
+        elif kind == BYE:
+            self.drop_node(node)
+
+    def _broadcast_events(self, room: Room, events: Iterable[Optional[dict]]) -> None:
+        for event in events:
+            if event is not None:
+                room.fanout.broadcast(Frame(event))
@@ -0,0 +1,143 @@
+import collections
+import datetime
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from chat.services.fanout import FanOut, POLICIES
+from chat.services.history import HistoryMessage, MessageHistory
+from chat.services.presence import Presence
+
+
+class Room:
+    """
+    Комната чата: свои соединения, список пользователей и буфер истории.
+    Рассылка идет только по соединениям комнаты.
+    """
+
+    def __init__(self, name: str, fanout: FanOut, history: MessageHistory):
+        self.name = name
+        self.fanout = fanout
+        self.history = history
+        self.presence = Presence()
+        # Сколько локальных соединений держат комнату, включая еще подключающиеся
+        self.refs = 0
+
+    @property
+    def empty(self) -> bool:
+        """ В комнате нет ни локальных соединений, ни пользователей других узлов. """
+        return not self.refs and not len(self.presence)
+
+
+class RoomRegistry:
+    """
+    Реестр комнат. Комната создается при первом обращении и удаляется,
+    как только опустеет, поэтому простаивающие комнаты не занимают память.
+    Комнаты ``keep_rooms`` не удаляются никогда.
+
+    Сообщения пишутся в БД с задержкой, поэтому у удаленной комнаты еще
+    ``idle_history_ttl`` секунд хранятся сообщения последних
+    ``idle_history_ttl`` секунд (не больше ``idle_histories`` комнат): если
+    комната снова понадобится, прогрев буфера из БД их не потеряет.
+
+    Локальное соединение держит комнату между ``acquire`` и ``release``.
+    События других узлов берут комнату через ``ensure`` и после обработки
+    вызывают ``collect``.
+
+    :param send_queue_size: размер исходящей очереди соединения
+    :param slow_consumer_policy: политика для переполненной очереди
+    :param history_size: размер буфера истории комнаты, сообщений
+    :param history_max_chars: размер буфера истории комнаты, символов текста
+    :param history_cache_ttl: сколько секунд переиспользовать запрос истории к БД
+    :param coalesce_window: окно склейки исходящих сообщений, сек., 0 - без склейки
+    :param coalesce_max_batch: максимум сообщений в одном склеенном фрейме
+    :param compress_min_size: сообщения короче стольких символов не сжимаются
+    :param keep_rooms: комнаты, которые не удаляются, даже опустев
+    :param idle_histories: недавние сообщения скольких удаленных комнат хранить
+    :param idle_history_ttl: за сколько последних секунд и сколько секунд их хранить
+    """
+
+    def __init__(self, send_queue_size: int, slow_consumer_policy: str,
+                 history_size: int, history_max_chars: int, history_cache_ttl: float = 0,
+                 coalesce_window: float = 0, coalesce_max_batch: int = 100, compress_min_size: int = 0,
+                 keep_rooms: Iterable[str] = (), idle_histories: int = 0, idle_history_ttl: float = 30):
+        if slow_consumer_policy not in POLICIES:
+            raise ValueError(f'Unknown slow consumer policy: {slow_consumer_policy}')
+
+        self.send_queue_size = send_queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.history_size = history_size
+        self.history_max_chars = history_max_chars
+        self.history_cache_ttl = history_cache_ttl
+        self.coalesce_window = coalesce_window
+        self.coalesce_max_batch = coalesce_max_batch
+        self.compress_min_size = compress_min_size
+        self.keep_rooms = frozenset(keep_rooms)
+        self.idle_histories = idle_histories
+        self.idle_history_ttl = idle_history_ttl
+
+        self._rooms: Dict[str, Room] = {}
+        # Недавние сообщения удаленных комнат: комната -> (хранить до, сообщения),
+        # от давно удаленных к недавним
+        self._idle: Dict[str, Tuple[float, List[HistoryMessage]]] = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._rooms)
+
+    def __iter__(self) -> Iterator[Room]:
+        return iter(self._rooms.values())
+
+    def get(self, name: str) -> Optional[Room]:
+        return self._rooms.get(name)
+
+    def acquire(self, name: str) -> Room:
+        room = self.ensure(name)
+        room.refs += 1
+        return room
+
+    def release(self, room: Room) -> None:
+        room.refs -= 1
+        self.collect(room)
+
+    def ensure(self, name: str) -> Room:
+        room = self._rooms.get(name)
+        if room is None:
+            history = MessageHistory(name, capacity=self.history_size, max_chars=self.history_max_chars,
+                                     cache_ttl=self.history_cache_ttl)
+            idle = self._idle.pop(name, None)
+            if idle is not None and idle[0] > time.monotonic():
+                # Буфер не прогрет: при прогреве сообщения, которых еще нет в БД, останутся
+                for mes in idle[1]:
+                    history.append(mes)
+
+            room = self._rooms[name] = Room(
+                name,
+                fanout=FanOut(
+                    maxsize=self.send_queue_size,
+                    policy=self.slow_consumer_policy,
+                    coalesce_window=self.coalesce_window,
+                    coalesce_max_batch=self.coalesce_max_batch,
+                    compress_min_size=self.compress_min_size,
+                ),
+                history=history,
+            )
+
+        return room
+
+    def collect(self, room: Room) -> None:
+        """ Удаляет комнату, если она опустела. """
+        if not room.empty or room.name in self.keep_rooms or self._rooms.get(room.name) is not room:
+            return
+
+        del self._rooms[room.name]
+        if not self.idle_histories:
+            return
+
+        now = time.monotonic()
+        for name in [name for name, (expires, _) in self._idle.items() if expires <= now]:
+            del self._idle[name]
+
+        recent = room.history.newer_than(datetime.datetime.now() - datetime.timedelta(seconds=self.idle_history_ttl))
+        if recent:
+            self._idle[room.name] = (now + self.idle_history_ttl, recent)
+            while len(self._idle) > self.idle_histories:
+                self._idle.popitem(last=False)
@@ -0,0 +1,69 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from chat.services.metrics import HISTORY_LOADS_SHARED
+
+
+class SingleFlight:
+    """
+    Один запрос на всех, кто одновременно просит одно и то же.
+
+    Пока запрос по ключу выполняется, остальные вызовы ``do`` с тем же
+    ключом ждут его результат, а не идут в БД сами. Готовый результат
+    еще ``ttl`` секунд отдается без запроса: при массовом переподключении
+    клиенты приходят не одновременно, а в течение секунды-двух. Ошибка
+    не кэшируется и достается всем, кто ждал этот запрос.
+
+    Результат общий для всех вызывающих, менять его нельзя.
+
+    :param ttl: сколько секунд отдавать готовый результат, 0 - только общий запрос
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._results: Dict[Hashable, Tuple[float, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable], ttl: Optional[float] = None) -> Any:
+        now = asyncio.get_event_loop().time()
+
+        cached = self._results.get(key)
+        if cached is not None:
+            expires, value = cached
+            if expires > now:
+                HISTORY_LOADS_SHARED.inc()
+                return value
+            del self._results[key]
+
+        call = self._calls.get(key)
+        if call is None:
+            self.prune(now)
+            call = self._calls[key] = asyncio.ensure_future(self._call(key, func, ttl))
+        else:
+            HISTORY_LOADS_SHARED.inc()
+
+        # Отмена одного из ждущих не отменяет запрос остальным
+        return await asyncio.shield(call)
+
+    def prune(self, now: Optional[float] = None) -> None:
+        """ Удаляет устаревшие результаты. """
+        if now is None:
+            now = asyncio.get_event_loop().time()
+
+        expired = [key for key, (expires, _) in self._results.items() if expires <= now]
+        for key in expired:
+            del self._results[key]
+
+    async def _call(self, key: Hashable, func: Callable[[], Awaitable], ttl: Optional[float]):
+        try:
+            value = await func()
+        finally:
+            del self._calls[key]
+
+        ttl = self.ttl if ttl is None else ttl
+        if ttl > 0:
+            self._results[key] = (asyncio.get_event_loop().time() + ttl, value)
+        return value
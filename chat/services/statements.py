@@ -0,0 +1,158 @@
+"""
+Быстрый путь для частых запросов чата.
+
+SQL собирается один раз при импорте и выполняется напрямую через asyncpg:
+на каждом соединении запрос подготавливается при первом вызове и дальше
+берется из кэша подготовленных запросов соединения (``statement_cache_size``
+в настройках пула). Результат - ``asyncpg.Record`` (кортеж с доступом
+по имени колонки) без моделей ``ChatMessage`` и компиляции SQLAlchemy.
+
+Порядок колонок в выборках совпадает с аргументами ``HistoryMessage``:
+``HistoryMessage.from_record`` строит сообщение распаковкой записи.
+"""
+import datetime
+from typing import AsyncIterator, Iterable, List, Optional
+
+import asyncpg
+
+from chat.services.metrics import acquire
+from config.models.chat_models import ChatMessage
+from config.settings import CHAT_HISTORY_LIMIT, CHAT_DEFAULT_ROOM
+
+TABLE = ChatMessage.__tablename__
+SEQUENCE = f'{TABLE}_id_seq'
+COLUMNS = 'id, nickname, text, created_date, room'
+
+# Блок id сообщений: id известен до записи в БД и уникален между воркерами
+RESERVE_IDS = f"SELECT nextval('{SEQUENCE}') FROM generate_series(1, $1)"
+
+INSERT_MESSAGE = f'''
+    INSERT INTO {TABLE} (room, nickname, text, created_date)
+    VALUES ($1, $2, $3, $4)
+    RETURNING {COLUMNS}
+'''
+# Пачка любого размера - один и тот же запрос, поэтому он тоже подготавливается один раз.
+# Сообщения без заранее выделенного id получают его из последовательности
+INSERT_MESSAGES = f'''
+    INSERT INTO {TABLE} (id, room, nickname, text, created_date)
+    SELECT coalesce(m.id, nextval('{SEQUENCE}')), m.room, m.nickname, m.text, m.created_date
+    FROM unnest($1::int[], $2::varchar[], $3::varchar[], $4::text[], $5::timestamp[])
+        AS m(id, room, nickname, text, created_date)
+'''
+SELECT_LAST = f'''
+    SELECT {COLUMNS} FROM {TABLE}
+    WHERE room = $1 AND created_date > current_date
+    ORDER BY created_date DESC, id DESC
+    LIMIT $2
+'''
+# Страницы истории без ограничения по дню. Курсор - id последнего сообщения
+# предыдущей страницы, дальше сравнение по (created_date, id) по индексу, без OFFSET
+SELECT_PAGE = f'''
+    SELECT {COLUMNS} FROM {TABLE}
+    WHERE room = $1
+    ORDER BY created_date DESC, id DESC
+    LIMIT $2
+'''
+SELECT_PAGE_BEFORE = f'''
+    SELECT {COLUMNS} FROM {TABLE}
+    WHERE room = $1 AND (created_date, id) < (SELECT created_date, id FROM {TABLE} WHERE id = $2)
+    ORDER BY created_date DESC, id DESC
+    LIMIT $3
+'''
+# Сообщения комнаты после данного, для возобновления после переподключения
+SELECT_MESSAGE_DATE = f'SELECT created_date FROM {TABLE} WHERE id = $1 AND room = $2'
+SELECT_AFTER = f'''
+    SELECT {COLUMNS} FROM {TABLE}
+    WHERE room = $1 AND (created_date, id) > ($2, $3)
+    ORDER BY created_date DESC, id DESC
+    LIMIT $4
+'''
+# Выгрузка за период: все комнаты, если $3 - NULL
+SELECT_RANGE = f'''
+    SELECT {COLUMNS} FROM {TABLE}
+    WHERE created_date >= $1 AND created_date < $2 AND ($3::varchar IS NULL OR room = $3)
+    ORDER BY created_date, id
+'''
+
+
+async def _execute(method: str, query: str, *args, bind=None):
+    """ Выполняет запрос на соединении ``bind`` или на соединении из пула. """
+    if bind is not None:
+        raw = await bind.get_raw_connection()
+        return await getattr(raw, method)(query, *args)
+
+    async with acquire() as conn:
+        raw = await conn.get_raw_connection()
+        return await getattr(raw, method)(query, *args)
+
+
+async def reserve_message_ids(count: int) -> List[int]:
+
+    return [record[0] for record in await _execute('fetch', RESERVE_IDS, count)]
+
+
+async def create_chat_message(nickname: str, text: str, room: str = CHAT_DEFAULT_ROOM,
+                              bind=None) -> asyncpg.Record:
+
+    return await _execute('fetchrow', INSERT_MESSAGE, room, nickname, text, datetime.datetime.now(), bind=bind)
+
+
+async def create_chat_messages(messages: Iterable, bind=None) -> str:
+    """ Одна вставка для пачки сообщений: колонки передаются массивами. """
+    messages = list(messages)
+    return await _execute(
+        'execute',
+        INSERT_MESSAGES,
+        [mes.id for mes in messages],
+        [mes.room for mes in messages],
+        [mes.nickname for mes in messages],
+        [mes.text for mes in messages],
+        [mes.created_date for mes in messages],
+        bind=bind,
+    )
+
+
+async def get_last_chat_messages(room: str = CHAT_DEFAULT_ROOM, limit: int = CHAT_HISTORY_LIMIT,
+                                 bind=None) -> List[asyncpg.Record]:
+    """ Последние ``limit`` сообщений комнаты за сегодня, от новых к старым. """
+    return await _execute('fetch', SELECT_LAST, room, limit, bind=bind)
+
+
+async def get_chat_messages_page(room: str, limit: int, before: Optional[int] = None,
+                                 bind=None) -> List[asyncpg.Record]:
+    """ Страница истории комнаты: ``limit`` сообщений старше ``before``, от новых к старым. """
+    if before is None:
+        return await _execute('fetch', SELECT_PAGE, room, limit, bind=bind)
+
+    return await _execute('fetch', SELECT_PAGE_BEFORE, room, before, limit, bind=bind)
+
+
+async def get_chat_messages_after(room: str, message_id: int, limit: int) -> Optional[tuple]:
+    """
+    Сообщения комнаты после ``message_id`` в порядке (created_date, id): не
+    больше ``limit`` самых новых, от новых к старым. Возвращает
+    ``(created_date сообщения message_id, записи)`` или ``None``, если такого
+    сообщения в комнате нет.
+    """
+    async with acquire() as conn:
+        raw = await conn.get_raw_connection()
+        created_date = await raw.fetchval(SELECT_MESSAGE_DATE, message_id, room)
+        if created_date is None:
+            return None
+
+        return created_date, await raw.fetch(SELECT_AFTER, room, created_date, message_id, limit)
+
+
+async def iterate_chat_messages(start: datetime.datetime, end: datetime.datetime, room: Optional[str] = None,
+                                prefetch: int = 1000) -> AsyncIterator[asyncpg.Record]:
+    """
+    Сообщения за ``[start, end)`` через курсор на стороне сервера: в памяти
+    не больше ``prefetch`` записей. Следующая порция читается, только когда
+    потребитель забрал предыдущую, поэтому медленный потребитель
+    притормаживает и чтение из БД. Соединение занято до конца итерации.
+    """
+    async with acquire() as conn:
+        raw = await conn.get_raw_connection()
+        async with raw.transaction(isolation='repeatable_read', readonly=True):
+            async for record in raw.cursor(SELECT_RANGE, start, end, room, prefetch=prefetch):
+                yield record
@@ -1,12 +1,7 @@
-import datetime
-
 import aiocron
 
-from chat.services.querysets import del_old_chat_message_queryset
-
-
-def get_time_now():
-    return time_to_str(datetime.datetime.now())
+from chat.services.partitions import maintain_partitions
+from config.settings import CHAT_PARTITION_DAYS_AHEAD, CHAT_RETENTION_DAYS, CHAT_PARTITION_RETIRE
 
 
 def time_to_str(time):
@@ -15,6 +10,13 @@ def time_to_str(time):
 
 @aiocron.crontab('0 1 * * *')
 async def db_cleanup():
-    """ Удаляет старые сообщения из БД. Запускается раз в день. """
-    await del_old_chat_message_queryset().gino.status()
+    """
+    Создает партиции сообщений на следующие дни и удаляет (или отсоединяет)
+    партиции старых дней. Запускается раз в день.
+    """
+    await maintain_partitions(
+        days_ahead=CHAT_PARTITION_DAYS_AHEAD,
+        keep_days=CHAT_RETENTION_DAYS,
+        mode=CHAT_PARTITION_RETIRE,
+    )
     print('БД очищена')
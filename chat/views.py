@@ -1,8 +1,43 @@
-from aiohttp import web, WSMsgType
+import datetime
+import time
+from typing import Optional
+
+from aiohttp import web, WSMsgType, WSCloseCode
 from loguru import logger
 
-from chat.services.querysets import create_chat_message_queryset, get_all_chat_message_queryset
-from chat.services.utils import get_time_now, time_to_str
+from chat.services.encoders import encode, msgpack_loads, protocols, Frame
+from chat.services.history import HistoryMessage
+from chat.services.metrics import (
+    MESSAGES_IN,
+    MESSAGES_THROTTLED,
+    BROADCAST_SECONDS,
+    HISTORY_LOAD_SECONDS,
+    CONNECTIONS_REJECTED,
+)
+from chat.services.ratelimit import THROTTLE, DISCONNECT
+from chat.services.statements import get_chat_messages_page, iterate_chat_messages
+from config.settings import (
+    CHAT_HISTORY_LIMIT,
+    CHAT_DEFAULT_ROOM,
+    CHAT_HISTORY_PAGE_MAX_LIMIT,
+    CHAT_HISTORY_GZIP_MIN_SIZE,
+    CHAT_EXPORT_PREFETCH,
+    CHAT_EXPORT_CHUNK_ROWS,
+    CHAT_WS_HEARTBEAT,
+    CHAT_WS_MAX_MSG_SIZE,
+    CHAT_WS_MAX_CONNECTIONS,
+    CHAT_WS_COMPRESS,
+    CHAT_WS_MSGPACK,
+    CHAT_RESUME_LIMIT,
+    CHAT_RECONNECT_DELAY_MS,
+    CHAT_RECONNECT_JITTER_MS,
+)
+
+# Ограничения колонок chat_message.room и chat_message.nickname
+ROOM_MAX_LENGTH = 50
+NICKNAME_MAX_LENGTH = 50
+# Служебное событие - ответ на ?since=<id>
+RESUME = 'resume'
 
 class Index(web.View):
 
@@ -12,79 +47,360 @@ class Index(web.View):
         return web.Response(text=ip, status=200)
 
 
+def query_int(request: web.Request, name: str, default: Optional[int]) -> Optional[int]:
+    value = request.query.get(name)
+    if value is None:
+        return default
+
+    try:
+        return int(value)
+    except ValueError:
+        raise web.HTTPBadRequest(text=f'{name} must be an integer')
+
+
+class History(web.View):
+    """
+    Страница истории комнаты: ``GET /history?room=<room>&before=<id>&limit=<n>``.
+
+    Отдает ``{"messages": [...], "next": <id>}``: сообщения от старых к новым,
+    ``next`` - значение ``before`` для следующей, более старой страницы
+    (``null``, если дальше сообщений нет). ``limit`` не больше
+    ``CHAT_HISTORY_PAGE_MAX_LIMIT``.
+
+    Сообщения не меняются, поэтому страницу однозначно задают ее крайние id:
+    из них строится ETag, а Last-Modified - время самого нового сообщения.
+    Большие страницы сжимаются gzip. Сообщения пишутся в БД пачками, так что
+    самые свежие попадают в историю с задержкой записи.
+    """
+
+    async def get(self):
+        room = self.request.query.get('room', CHAT_DEFAULT_ROOM)
+        if len(room) > ROOM_MAX_LENGTH:
+            raise web.HTTPBadRequest(text=f'Room name is longer than {ROOM_MAX_LENGTH}')
+
+        before = query_int(self.request, 'before', None)
+        limit = query_int(self.request, 'limit', CHAT_HISTORY_LIMIT)
+        if limit < 1:
+            raise web.HTTPBadRequest(text='limit must be positive')
+        limit = min(limit, CHAT_HISTORY_PAGE_MAX_LIMIT)
+
+        # Одинаковые страницы при наплыве клиентов - один запрос и одна сериализация
+        messages, body = await self.request.app.history_pages.do(
+            (room, before, limit), lambda: self.load_page(room, limit, before))
+        next_before = messages[0].id if len(messages) == limit else None
+
+        headers = {
+            'Vary': 'Accept-Encoding',
+            # Старые страницы меняются только при удалении партиций
+            'Cache-Control': 'public, max-age=3600' if before is not None else 'no-cache',
+        }
+        if messages:
+            headers['ETag'] = f'W/"{messages[0].id}-{messages[-1].id}-{len(messages)}-{next_before is not None:d}"'
+        else:
+            headers['ETag'] = 'W/"empty"'
+
+        last_modified = messages[-1].created_date.astimezone(datetime.timezone.utc) if messages else None
+        if self.not_modified(headers['ETag'], last_modified):
+            response = web.Response(status=304, headers=headers)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            return response
+
+        response = web.Response(text=body, content_type='application/json', headers=headers)
+        if last_modified is not None:
+            response.last_modified = last_modified
+
+        if len(body) >= CHAT_HISTORY_GZIP_MIN_SIZE and 'gzip' in self.request.headers.get('Accept-Encoding', ''):
+            response.enable_compression(web.ContentCoding.gzip)
+
+        return response
+
+    @staticmethod
+    async def load_page(room: str, limit: int, before: Optional[int]):
+        records = await get_chat_messages_page(room, limit, before)
+        messages = [HistoryMessage.from_record(record) for record in reversed(records)]
+        body = encode({
+            'messages': [
+                {'date': mes.created_date.isoformat(), **mes.to_dict()}
+                for mes in messages
+            ],
+            'next': messages[0].id if len(messages) == limit else None,
+        })
+        return messages, body
+
+    def not_modified(self, etag: str, last_modified: Optional[datetime.datetime]) -> bool:
+        """ Проверка If-None-Match, а если его нет - If-Modified-Since. """
+        if_none_match = self.request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag in (tag.strip() for tag in if_none_match.split(',')) or if_none_match.strip() == '*'
+
+        if_modified_since = self.request.if_modified_since
+        if if_modified_since is None or last_modified is None:
+            return False
+
+        # В заголовке время с точностью до секунды
+        return last_modified.replace(microsecond=0) <= if_modified_since
+
+
+def query_date(request: web.Request, name: str, default: datetime.date) -> datetime.date:
+    value = request.query.get(name)
+    if value is None:
+        return default
+
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise web.HTTPBadRequest(text=f'{name} must be a date in YYYY-MM-DD format')
+
+
+class Export(web.View):
+    """
+    Выгрузка сообщений в NDJSON: ``GET /export?from=2020-11-01&to=2020-11-02&room=main``.
+
+    ``from`` (по умолчанию сегодня) и ``to`` (по умолчанию следующий день
+    после ``from``) задают дни ``[from, to)``, без ``room`` выгружаются все
+    комнаты. Строки читаются курсором и уходят клиенту чанками, пока клиент
+    не прочитал чанк, следующие строки из БД не читаются: память не зависит
+    от размера выгрузки. Одновременных выгрузок не больше
+    ``CHAT_EXPORT_CONCURRENCY``, остальные получают 503.
+    """
+
+    async def get(self):
+        start = query_date(self.request, 'from', datetime.date.today())
+        end = query_date(self.request, 'to', start + datetime.timedelta(days=1))
+        room = self.request.query.get('room')
+        if end <= start:
+            raise web.HTTPBadRequest(text='to must be later than from')
+
+        exports = self.request.app.exports
+        if exports.locked():
+            raise web.HTTPServiceUnavailable(text='Too many exports in progress')
+
+        async with exports:
+            response = web.StreamResponse(headers={
+                'Content-Type': 'application/x-ndjson; charset=utf-8',
+                'Content-Disposition': f'attachment; filename="chat_{start}_{end}.ndjson"',
+            })
+            response.enable_chunked_encoding()
+            await response.prepare(self.request)
+
+            lines = []
+            records = iterate_chat_messages(
+                datetime.datetime.combine(start, datetime.time()),
+                datetime.datetime.combine(end, datetime.time()),
+                room,
+                prefetch=CHAT_EXPORT_PREFETCH,
+            )
+            try:
+                async for record in records:
+                    mes = HistoryMessage.from_record(record)
+                    lines.append(encode({
+                        'id': mes.id,
+                        'room': mes.room,
+                        'user': mes.nickname,
+                        'text': mes.text,
+                        'date': mes.created_date.isoformat(),
+                    }))
+                    if len(lines) >= CHAT_EXPORT_CHUNK_ROWS:
+                        # write ждет, пока клиент не разберет буфер сокета
+                        await response.write(('\n'.join(lines) + '\n').encode())
+                        lines.clear()
+            finally:
+                # Если клиент отключился, курсор и соединение освобождаются сразу
+                await records.aclose()
+
+            if lines:
+                await response.write(('\n'.join(lines) + '\n').encode())
+            await response.write_eof()
+
+        return response
+
+
 class WebSocket(web.View):
 
     async def get(self):
-        ws = web.WebSocketResponse()
-        await ws.prepare(self.request)
-        
+        room_name = self.request.match_info.get('room', CHAT_DEFAULT_ROOM)
+        if len(room_name) > ROOM_MAX_LENGTH:
+            raise web.HTTPBadRequest(text=f'Room name is longer than {ROOM_MAX_LENGTH}')
+
+        # До prepare: после него ошибку уже не вернуть ответом 400
         self.user = self.request.match_info['user']
-        self.request.app.wslist[self.user] = ws
+        if len(self.user) > NICKNAME_MAX_LENGTH:
+            raise web.HTTPBadRequest(text=f'Nickname is longer than {NICKNAME_MAX_LENGTH}')
+        since = query_int(self.request, 'since', None)
+
+        if self.request.app.draining:
+            retry_after = (CHAT_RECONNECT_DELAY_MS + CHAT_RECONNECT_JITTER_MS) // 1000 or 1
+            raise web.HTTPServiceUnavailable(text='Server is restarting', headers={'Retry-After': str(retry_after)})
+
+        if CHAT_WS_MAX_CONNECTIONS and len(self.request.app.connections) >= CHAT_WS_MAX_CONNECTIONS:
+            CONNECTIONS_REJECTED.inc()
+            raise web.HTTPServiceUnavailable(text='Too many connections')
+
+        # Без pong за половину периода heartbeat aiohttp сам рвет соединение
+        ws = web.WebSocketResponse(
+            heartbeat=CHAT_WS_HEARTBEAT or None,
+            max_msg_size=CHAT_WS_MAX_MSG_SIZE,
+            compress=CHAT_WS_COMPRESS,
+            protocols=protocols(CHAT_WS_MSGPACK),
+        )
+        await ws.prepare(self.request)
 
-        await self.get_last_message(ws)      
+        self.room = self.request.app.rooms.acquire(room_name)
 
-        async for msg in ws:
+        # История берется до регистрации: пока идет запрос к БД,
+        # новые сообщения не должны обогнать историю в очереди
+        try:
+            missed = await self.room.history.since(since, CHAT_RESUME_LIMIT) if since is not None else None
+            messeges = missed[0] if missed is not None else await self.get_last_message()
+        except BaseException:
+            self.request.app.rooms.release(self.room)
+            raise
+
+        self.join()
+        self.sender = self.room.fanout.register(self.user, ws)
+        self.request.app.connections.add(self.sender)
+        self.send_massage(self.sender, Frame(self.room.presence.snapshot()))
+        if since is not None:
+            # complete = false: часть пропущенного не пришла, ее можно дозапросить через GET /history
+            self.send_massage(self.sender, Frame({
+                'type': RESUME,
+                'since': since,
+                'complete': missed is not None and missed[1],
+            }))
+        for mes in messeges:
+            self.send_massage(self.sender, mes.frame)
+
+        try:
+            async for msg in ws:
+                self.sender.last_seen = time.monotonic()
+
+                if msg.type == WSMsgType.text:
+                    text = msg.data
+
+                elif msg.type == WSMsgType.binary and self.sender.binary:
+                    # Клиенты MessagePack шлют ту же строку, упакованную в MessagePack
+                    text = self.unpack(msg.data)
+                    if text is None:
+                        continue
+
+                elif msg.type == WSMsgType.error:
+                    break
 
-            if msg.type == WSMsgType.text:
-                if msg.data == 'close':
+                elif msg.type == WSMsgType.closed:
                     await ws.close()
                     break
 
                 else:
-                    await create_chat_message_queryset(self.user, msg.data)
-                    await self.broadcast(msg.data)
+                    continue
 
-            elif msg.type == WSMsgType.error:
-                break
+                if text == 'close':
+                    await ws.close()
+                    break
 
-            elif msg.type == WSMsgType.closed:
-                await ws.close()
-                break
+                self.sender.received += 1
+                MESSAGES_IN.inc()
+                if not self.check_rate():
+                    if self.request.app.limiter.policy == DISCONNECT:
+                        # Сразу, а не через Sender.close: иначе первым сокет закроет disconnect
+                        await ws.close(code=WSCloseCode.POLICY_VIOLATION, message=b'rate limit')
+                        break
+                    continue
 
-        await self.disconnect(ws, self.user)
+                await self.broadcast(text)
+
+        finally:
+            await self.disconnect(ws, self.user)
 
         return ws
     
-    def get_user_in_chat(self):
-        return [user for user in self.request.app.wslist]
-
-    async def get_last_message(self, ws):
-        """ Шлем пользователю последние сообщения при подключении. """
-        messeges = await get_all_chat_message_queryset().gino.all()
-
-        for mes in messeges[-30:]:
-            message = {
-                'text': mes.text,
-                'user': mes.nickname,
-                'time': time_to_str(mes.created_date),
-                'user_list': self.get_user_in_chat(),
-            }
-            await self.send_massage(ws, mes.nickname, message)
-
-
-    async def broadcast(self, text, user=None):
-        """ Отправка сообщений всем. """
-        user = self.user if user is None else user
-
-        message = {
-            'text': text,
-            'user': user,
-            'time': get_time_now(),
-            'user_list': self.get_user_in_chat(),
-        }
+    def join(self):
+        """ Сообщаем остальным в комнате, что пользователь зашел. """
+        event = self.room.presence.join(self.user)
+        self.request.app.relay.publish_join(self.room.name, self.user)
+        if event is not None:
+            self.room.fanout.broadcast(Frame(event))
+
+    def leave(self):
+        """ Сообщаем остальным в комнате, что пользователь вышел. """
+        event = self.room.presence.leave(self.user)
+        if self.request.app.draining:
+            # Воркер закрывает все соединения, другим узлам обо всех сразу сообщит BYE
+            return
+
+        self.request.app.relay.publish_leave(self.room.name, self.user)
+        if event is not None:
+            self.room.fanout.broadcast(Frame(event))
+
+    async def get_last_message(self):
+        """ Последние сообщения комнаты, которые шлем пользователю при подключении. """
+        start = time.perf_counter()
+        history = self.room.history
+
+        if not history.warmed:
+            await history.warm_up()
 
-        for user, ws in list(self.request.app.wslist.items()):
-            await self.send_massage(ws, user, message)
+        messeges = await history.recent(CHAT_HISTORY_LIMIT)
 
-    async def send_massage(self, ws, user, message):
-        """ Отправка сообщения. """
+        HISTORY_LOAD_SECONDS.observe(time.perf_counter() - start)
+        return messeges
+
+    async def broadcast(self, text):
+        """
+        Отправка сообщений всем в комнате. Сообщение попадает в буфер истории,
+        а в БД пишется позже пачкой, но id получает сразу.
+        """
+        mes_id = self.request.app.ids.next()
+        mes = HistoryMessage(mes_id, self.user, text, datetime.datetime.now(), self.room.name)
+        self.room.history.append(mes)
+
+        start = time.perf_counter()
+        self.room.fanout.broadcast(mes.frame)
+        BROADCAST_SECONDS.observe(time.perf_counter() - start)
+
+        self.request.app.relay.publish_message(mes)
+        self.request.app.persister.add(mes)
+
+    def check_rate(self) -> bool:
+        """
+        Проверка лимита входящих сообщений. Сверх лимита отправителю уходит
+        ``{"type": "throttle", "retry_after": <сек.>}``, а при политике
+        ``disconnect`` соединение закрывает цикл чтения.
+        """
+        limiter = self.request.app.limiter
+        if limiter is None:
+            return True
+
+        retry_after = limiter.acquire(self.user)
+        if not retry_after:
+            return True
+
+        MESSAGES_THROTTLED.inc()
+        if limiter.policy != DISCONNECT:
+            self.send_massage(self.sender, Frame({'type': THROTTLE, 'retry_after': round(retry_after, 3)}))
+        return False
+
+    def unpack(self, data: bytes) -> Optional[str]:
         try:
-            await ws.send_json(message)
-        except ConnectionResetError:
-            await self.disconnect(ws, user=user)
+            text = msgpack_loads(data)
+        except ValueError:
+            text = None
+
+        if not isinstance(text, str):
+            logger.info(f'Invalid MessagePack frame from {self.user}')
+            return None
+        return text
 
+    def send_massage(self, sender, message):
+        """ Отправка сообщения: ставим в исходящую очередь соединения. """
+        sender.put(message)
 
     async def disconnect(self, ws, user):
         """ Закрываем соединение и отправлем сообщение о выходе. """
-        self.request.app.wslist.pop(user, None)
-        await ws.close()
+        self.request.app.connections.remove(self.sender)
+        self.room.fanout.unregister(self.sender)
+        self.leave()
+        self.request.app.rooms.release(self.room)
+        # Если сокет закрывает сервер (политика, reaper, остановка), закрытие
+        # в фоне ждет цикл чтения, и первым код отправляет этот вызов
+        await ws.close(code=self.sender.close_code, message=self.sender.close_message)
@@ -10,8 +10,13 @@ metadata = Base.metadata
 
 class ChatMessage(db.Model):
     __tablename__ = 'chat_message'
+    # Партиции по дням создает и удаляет chat.services.partitions
+    __table_args__ = {'postgresql_partition_by': 'RANGE (created_date)'}
 
     id = db.Column(db.Integer, primary_key=True)
+    room = db.Column(db.String(50), nullable=False, server_default='main')
     nickname = db.Column(db.String(50), nullable=False)
-    created_date = db.Column(db.DateTime, default=datetime.datetime.now())
+    created_date = db.Column(db.DateTime, primary_key=True, default=datetime.datetime.now)
     text =  db.Column(db.Text, nullable=False)
+
+    _room_created_date_id_idx = db.Index('ix_chat_message_room_created_date_id', 'room', 'created_date', 'id')
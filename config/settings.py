@@ -12,6 +12,16 @@ from utils.db import GinoDB
 # --- Подгружаем переменные окружения, обновляя существующие с предыдущего запуска
 load_dotenv(find_dotenv(), override=True, verbose=True)
 
+# Пул соединений asyncpg: размеры, время жизни простаивающего соединения (сек.),
+# размер кэша подготовленных запросов на соединение и таймаут запроса (сек.)
+CHAT_DB_POOL = {
+    "pool_min_size": int(os.getenv("CHAT_DB_POOL_MIN_SIZE", 5)),
+    "pool_max_size": int(os.getenv("CHAT_DB_POOL_MAX_SIZE", 10)),
+    "max_inactive_connection_lifetime": float(os.getenv("CHAT_DB_POOL_MAX_INACTIVE_LIFETIME", 300)),
+    "statement_cache_size": int(os.getenv("CHAT_DB_STATEMENT_CACHE_SIZE", 100)),
+    "command_timeout": float(os.getenv("CHAT_DB_COMMAND_TIMEOUT", 30)),
+}
+
 DB_BINDINGS = {
     "chat": {
         "development": {
@@ -20,6 +30,7 @@ DB_BINDINGS = {
             "password": os.getenv("CHAT_DB_PASSWORD"),
             "database": os.getenv("CHAT_DB_NAME"),
             "host": os.getenv("CHAT_DB_HOST"),
+            **CHAT_DB_POOL,
         },
          "test": {
             "dsn": os.getenv("TEST_DB_URL"),
@@ -28,6 +39,7 @@ DB_BINDINGS = {
             "database": os.getenv("TEST_DB_NAME"),
             "host": os.getenv("TEST_DB_HOST"),
             "port": os.getenv("TEST_DB_PORT"),
+            **CHAT_DB_POOL,
         },
     },
 }
@@ -61,6 +73,103 @@ databases_ = [
 ]
 
 
+# --- Чат
+# Комната по умолчанию для /ws/{user}
+CHAT_DEFAULT_ROOM = os.getenv("CHAT_DEFAULT_ROOM", "main")
+# Сколько последних сообщений получает пользователь при подключении
+CHAT_HISTORY_LIMIT = int(os.getenv("CHAT_HISTORY_LIMIT", 30))
+# Размер буфера последних сообщений в памяти: количество и суммарная длина текста
+CHAT_HISTORY_SIZE = max(int(os.getenv("CHAT_HISTORY_SIZE", 1000)), CHAT_HISTORY_LIMIT)
+CHAT_HISTORY_MAX_CHARS = int(os.getenv("CHAT_HISTORY_MAX_CHARS", 1_000_000))
+# Сколько id сообщений воркер резервирует в БД за один запрос
+CHAT_ID_BLOCK_SIZE = int(os.getenv("CHAT_ID_BLOCK_SIZE", 100))
+# Сколько пропущенных сообщений максимум отдается при переподключении с ?since=<id>
+CHAT_RESUME_LIMIT = int(os.getenv("CHAT_RESUME_LIMIT", 1000))
+# Сколько секунд одинаковые запросы истории к БД отдаются из одного результата
+# (массовое переподключение), 0 - только одновременные
+CHAT_HISTORY_CACHE_TTL = float(os.getenv("CHAT_HISTORY_CACHE_TTL", 1))
+# Сообщения опустевшей комнаты могут быть еще не записаны в БД: сообщения
+# последних CHAT_IDLE_HISTORY_TTL секунд стольких комнат остаются в памяти
+# на CHAT_IDLE_HISTORY_TTL секунд
+CHAT_IDLE_HISTORY_ROOMS = int(os.getenv("CHAT_IDLE_HISTORY_ROOMS", 20))
+CHAT_IDLE_HISTORY_TTL = float(os.getenv("CHAT_IDLE_HISTORY_TTL", 30))
+# Страницы GET /history: предел limit и размер ответа, с которого он сжимается gzip
+CHAT_HISTORY_PAGE_MAX_LIMIT = int(os.getenv("CHAT_HISTORY_PAGE_MAX_LIMIT", 200))
+CHAT_HISTORY_GZIP_MIN_SIZE = int(os.getenv("CHAT_HISTORY_GZIP_MIN_SIZE", 1024))
+# Выгрузка GET /export: строк за одно чтение курсора, строк в одном чанке ответа
+# и одновременных выгрузок на воркер (каждая держит соединение из пула)
+CHAT_EXPORT_PREFETCH = int(os.getenv("CHAT_EXPORT_PREFETCH", 1000))
+CHAT_EXPORT_CHUNK_ROWS = int(os.getenv("CHAT_EXPORT_CHUNK_ROWS", 500))
+CHAT_EXPORT_CONCURRENCY = int(os.getenv("CHAT_EXPORT_CONCURRENCY", 2))
+# WebSocket: период ping/pong (0 - выключен), закрытие после стольких секунд
+# без входящих фреймов (0 - не закрывать; читатели, которые ничего не пишут,
+# тоже простаивают, мертвые соединения находит ping/pong), предел размера входящего сообщения,
+# предел соединений на воркер (0 - без предела) и период проверки соединений
+CHAT_WS_HEARTBEAT = float(os.getenv("CHAT_WS_HEARTBEAT", 30))
+CHAT_WS_IDLE_TIMEOUT = float(os.getenv("CHAT_WS_IDLE_TIMEOUT", 0))
+CHAT_WS_MAX_MSG_SIZE = int(os.getenv("CHAT_WS_MAX_MSG_SIZE", 64 * 1024))
+CHAT_WS_MAX_CONNECTIONS = int(os.getenv("CHAT_WS_MAX_CONNECTIONS", 10_000))
+CHAT_WS_REAP_INTERVAL = float(os.getenv("CHAT_WS_REAP_INTERVAL", 30))
+# permessage-deflate: согласовывать ли сжатие с клиентом и с какого размера
+# сообщения (символов) сжимать; короткие строки чата от сжатия только растут
+CHAT_WS_COMPRESS = os.getenv("CHAT_WS_COMPRESS", "1") == "1"
+CHAT_WS_COMPRESS_MIN_SIZE = int(os.getenv("CHAT_WS_COMPRESS_MIN_SIZE", 256))
+# Предлагать клиентам подпротокол chat.msgpack (если установлен msgpack)
+CHAT_WS_MSGPACK = os.getenv("CHAT_WS_MSGPACK", "1") == "1"
+# Остановка воркера: сколько секунд закрывать соединения и через сколько мс
+# клиентам переподключаться (плюс случайная добавка до CHAT_RECONNECT_JITTER_MS)
+CHAT_DRAIN_TIMEOUT = float(os.getenv("CHAT_DRAIN_TIMEOUT", 10))
+CHAT_RECONNECT_DELAY_MS = int(os.getenv("CHAT_RECONNECT_DELAY_MS", 1000))
+CHAT_RECONNECT_JITTER_MS = int(os.getenv("CHAT_RECONNECT_JITTER_MS", 10_000))
+# Склейка исходящих сообщений комнаты в один фрейм-массив: окно, сек.
+# (0 - выключена) и максимум сообщений в одном фрейме
+CHAT_COALESCE_WINDOW = float(os.getenv("CHAT_COALESCE_WINDOW", 0))
+CHAT_COALESCE_MAX_BATCH = int(os.getenv("CHAT_COALESCE_MAX_BATCH", 100))
+# Ограничение входящих сообщений на ник: сообщений в секунду (0 - без ограничения),
+# сколько можно отправить подряд и что делать сверх лимита: throttle | disconnect
+CHAT_RATE_LIMIT = float(os.getenv("CHAT_RATE_LIMIT", 5))
+CHAT_RATE_BURST = int(os.getenv("CHAT_RATE_BURST", 20))
+CHAT_RATE_LIMIT_POLICY = os.getenv("CHAT_RATE_LIMIT_POLICY", "throttle")
+# Исходящая очередь каждого соединения и политика для медленных клиентов:
+# drop_oldest | drop_newest | disconnect
+CHAT_SEND_QUEUE_SIZE = int(os.getenv("CHAT_SEND_QUEUE_SIZE", 256))
+CHAT_SLOW_CONSUMER_POLICY = os.getenv("CHAT_SLOW_CONSUMER_POLICY", "drop_oldest")
+# Отложенная запись сообщений в БД: размер пачки, интервал сброса (сек.),
+# предел буфера и задержки повтора при недоступной БД (сек.)
+CHAT_PERSIST_BATCH_SIZE = int(os.getenv("CHAT_PERSIST_BATCH_SIZE", 500))
+CHAT_PERSIST_FLUSH_INTERVAL = float(os.getenv("CHAT_PERSIST_FLUSH_INTERVAL", 0.5))
+CHAT_PERSIST_MAX_PENDING = int(os.getenv("CHAT_PERSIST_MAX_PENDING", 100_000))
+CHAT_PERSIST_RETRY_DELAY = float(os.getenv("CHAT_PERSIST_RETRY_DELAY", 0.5))
+CHAT_PERSIST_MAX_RETRY_DELAY = float(os.getenv("CHAT_PERSIST_MAX_RETRY_DELAY", 10))
+CHAT_PERSIST_SHUTDOWN_TIMEOUT = float(os.getenv("CHAT_PERSIST_SHUTDOWN_TIMEOUT", 10))
+# Шина между воркерами: local (один воркер) | postgres (LISTEN/NOTIFY)
+CHAT_BACKPLANE = os.getenv("CHAT_BACKPLANE", "local")
+CHAT_BACKPLANE_CHANNEL = os.getenv("CHAT_BACKPLANE_CHANNEL", "chat")
+CHAT_BACKPLANE_MAX_PAYLOAD = int(os.getenv("CHAT_BACKPLANE_MAX_PAYLOAD", 7900))
+# Период heartbeat узла (сек.) и через сколько секунд без событий узел
+# считается упавшим, а его пользователи - вышедшими
+CHAT_BACKPLANE_HEARTBEAT = float(os.getenv("CHAT_BACKPLANE_HEARTBEAT", 10))
+CHAT_BACKPLANE_NODE_TIMEOUT = float(os.getenv("CHAT_BACKPLANE_NODE_TIMEOUT", 30))
+# Партиции chat_message по дням: на сколько дней вперед создавать,
+# сколько дней хранить (сегодня считается) и что делать со старыми: drop | detach
+CHAT_PARTITION_DAYS_AHEAD = int(os.getenv("CHAT_PARTITION_DAYS_AHEAD", 7))
+CHAT_RETENTION_DAYS = int(os.getenv("CHAT_RETENTION_DAYS", 1))
+CHAT_PARTITION_RETIRE = os.getenv("CHAT_PARTITION_RETIRE", "drop")
+# JSON-энкодер исходящих сообщений: auto | json | orjson
+CHAT_JSON_ENCODER = os.getenv("CHAT_JSON_ENCODER", "auto")
+# Отладочный режим asyncio (медленные колбэки, незавершенные корутины) заметно
+# замедляет цикл событий: 1 | 0, по умолчанию включен только в билде development
+CHAT_ASYNCIO_DEBUG = os.getenv("CHAT_ASYNCIO_DEBUG", "")
+
+
+# --- Журнал запросов: очередь, пачка, интервал записи (сек.)
+# и доли записываемых запросов по префиксам пути, например "/metrics=0.01,/test=0.1"
+ACCESS_LOG_QUEUE_SIZE = int(os.getenv("ACCESS_LOG_QUEUE_SIZE", 10_000))
+ACCESS_LOG_BATCH_SIZE = int(os.getenv("ACCESS_LOG_BATCH_SIZE", 200))
+ACCESS_LOG_FLUSH_INTERVAL = float(os.getenv("ACCESS_LOG_FLUSH_INTERVAL", 1))
+ACCESS_LOG_SAMPLING = os.getenv("ACCESS_LOG_SAMPLING", "")
+
+
 # /alembic db for tests
 ALEMBIC_TEST_DB = os.getenv('ALEMBIC_TEST_DB')
 
@@ -1,6 +1,15 @@
+import os
+
 bind = "0.0.0.0:5005"
-timeout = 36000
-workers = 1
+# Воркер aiohttp отчитывается мастеру каждую секунду независимо от соединений,
+# поэтому долгий таймаут ради вебсокетов не нужен
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+# Остановка воркера: закрытие соединений (CHAT_DRAIN_TIMEOUT) и запись
+# буфера сообщений (CHAT_PERSIST_SHUTDOWN_TIMEOUT) должны уложиться сюда
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+# Больше одного воркера - только с CHAT_BACKPLANE=postgres,
+# иначе каждый воркер будет отдельным чатом
+workers = int(os.getenv("GUNICORN_WORKERS", 1))
 max_requests = 1000
 max_requests_jitter = 50
 worker_class = 'aiohttp.GunicornUVLoopWebWorker'
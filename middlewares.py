@@ -1,23 +1,28 @@
 # -*- coding: utf-8 -*-
-import asyncio
+import time
 
 from aiohttp import web
-from loguru import logger
-
-
-async def logger_info(msg, ):
-    logger.info(msg)
 
 
 @web.middleware
 async def log_middleware(request, handler):
-    response = await handler(request)
-    short_msg = f'{request._rel_url.path}: STATUS: {getattr(response, "status", "ERROR")} '
+    """ Пишет запрос в журнал ``app.access_log``: сама запись идет в фоне. """
+    start = time.perf_counter()
+    status = 'ERROR'
+
+    try:
+        response = await handler(request)
+        status = getattr(response, 'status', 'ERROR')
+        return response
 
-    other_msg = [
-        lambda: short_msg,
-    ]
-    for x in other_msg:
-        asyncio.ensure_future(logger_info(x()))
+    except web.HTTPException as e:
+        status = e.status
+        raise
 
-    return response
+    finally:
+        request.app.access_log.record(
+            path=request.rel_url.path,
+            status=status,
+            duration=time.perf_counter() - start,
+            remote=request.remote,
+        )
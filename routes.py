@@ -1,6 +1,11 @@
 from chat.routes import routes as chat_routes
+from utils.metrics import MetricsView
+
+
+metrics_url = '/metrics'
 
 
 routes = [
     *chat_routes,
+    (metrics_url, MetricsView),
 ]
@@ -0,0 +1,22 @@
+from utils.access_log import AccessLog, parse_sampling, ACCESS_LOG_DROPPED
+
+
+def test_parse_sampling():
+    assert parse_sampling('') == {}
+    assert parse_sampling('/metrics=0.01, /test=0.5') == {'/metrics': 0.01, '/test': 0.5}
+
+
+async def test_access_log_overflow_and_flush():
+    log = AccessLog(maxsize=2, batch_size=10, flush_interval=60, sampling={'/metrics': 0})
+    dropped = ACCESS_LOG_DROPPED.value
+
+    log.record('/metrics', 200, 0.001, '127.0.0.1')
+    for _ in range(3):
+        log.record('/test', 200, 0.001, '127.0.0.1')
+
+    assert len(log) == 2
+    assert ACCESS_LOG_DROPPED.value == dropped + 1
+
+    log.start()
+    await log.stop()
+    assert len(log) == 0
@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+from chat.services.backplane import LocalBackplane, PostgresBackplane
+from config.settings import DB_BINDINGS
+
+
+class Inbox:
+    """ Обработчик событий шины, который запоминает полученное. """
+
+    def __init__(self, expected=1):
+        self.events = []
+        self.expected = expected
+        self.done = asyncio.Event()
+
+    def __call__(self, node, kind, data):
+        self.events.append((node, kind, data))
+        if len(self.events) >= self.expected:
+            self.done.set()
+
+
+async def exchange(first, second, data, expected=1):
+    """ Первый узел публикует, второй должен получить, первый - нет. """
+    first_inbox, second_inbox = Inbox(), Inbox(expected)
+    await first.start(first_inbox)
+    await second.start(second_inbox)
+
+    try:
+        first.publish('message', data)
+        await asyncio.wait_for(second_inbox.done.wait(), timeout=5)
+        await asyncio.sleep(0.1)
+    finally:
+        await first.stop()
+        await second.stop()
+
+    return first_inbox, second_inbox
+
+
+@pytest.mark.parametrize('size', [10, 30000])
+async def test_local_backplane(size):
+    first = LocalBackplane(channel='test', max_payload=7900)
+    second = LocalBackplane(channel='test', max_payload=7900)
+    data = {'text': 'x' * size}
+
+    first_inbox, second_inbox = await exchange(first, second, data)
+
+    assert second_inbox.events == [(first.node_id, 'message', data)]
+    assert first_inbox.events == []
+
+
+@pytest.mark.parametrize('size', [10, 30000])
+async def test_postgres_backplane_between_workers(size):
+    dsn = DB_BINDINGS['chat']['test']['dsn']
+    first = PostgresBackplane(dsn=dsn, channel='test_chat')
+    second = PostgresBackplane(dsn=dsn, channel='test_chat')
+    data = {'text': 'я' * size}
+
+    first_inbox, second_inbox = await exchange(first, second, data)
+
+    assert second_inbox.events == [(first.node_id, 'message', data)]
+    assert first_inbox.events == []
+
+
+async def test_postgres_backplane_keeps_duplicate_events():
+    """ Одинаковые события одной отправки не должны склеиваться в одно NOTIFY. """
+    dsn = DB_BINDINGS['chat']['test']['dsn']
+    first = PostgresBackplane(dsn=dsn, channel='test_chat_duplicates')
+    second = PostgresBackplane(dsn=dsn, channel='test_chat_duplicates')
+    inbox = Inbox(expected=4)
+    await first.start(Inbox())
+    await second.start(inbox)
+
+    try:
+        for kind in ('join', 'leave', 'join'):
+            first.publish(kind, {'room': 'main', 'user': 'alice'})
+        first.publish('join', {'room': 'main', 'user': 'alice'})
+        await asyncio.wait_for(inbox.done.wait(), timeout=5)
+        await asyncio.sleep(0.1)
+    finally:
+        await first.stop()
+        await second.stop()
+
+    assert [kind for _, kind, _ in inbox.events] == ['join', 'leave', 'join', 'join']
+
+
+
+async def test_backplane_resends_failed_batch(monkeypatch):
+    monkeypatch.setattr('chat.services.backplane.RETRY_DELAY', 0.01)
+    first = LocalBackplane(channel='test_retry', max_payload=7900)
+    second = LocalBackplane(channel='test_retry', max_payload=7900)
+    inbox = Inbox(expected=2)
+    await first.start(Inbox())
+    await second.start(inbox)
+
+    send = first._send
+    failures = []
+
+    async def flaky_send(payloads):
+        if not failures:
+            failures.append(payloads)
+            raise ConnectionResetError()
+        await send(payloads)
+
+    first._send = flaky_send
+    try:
+        first.publish('join', {'room': 'main', 'user': 'alice'})
+        first.publish('leave', {'room': 'main', 'user': 'alice'})
+        await asyncio.wait_for(inbox.done.wait(), timeout=5)
+    finally:
+        await first.stop()
+        await second.stop()
+
+    assert len(failures) == 1
+    assert [kind for _, kind, _ in inbox.events] == ['join', 'leave']
+
+
+async def test_postgres_backplane_relistens_after_connection_loss():
+    dsn = DB_BINDINGS['chat']['test']['dsn']
+    first = PostgresBackplane(dsn=dsn, channel='test_chat_reconnect')
+    second = PostgresBackplane(dsn=dsn, channel='test_chat_reconnect', check_interval=0.1)
+    inbox = Inbox()
+    reconnected = asyncio.Event()
+    await first.start(Inbox())
+    await second.start(inbox, on_reconnect=reconnected.set)
+
+    try:
+        # Так выглядит для узла перезапуск Postgres
+        pid = second._listener.get_server_pid()
+        async with first._pool.acquire() as conn:
+            await conn.execute('SELECT pg_terminate_backend($1)', pid)
+        await asyncio.wait_for(reconnected.wait(), timeout=5)
+
+        first.publish('message', {'text': 'hello again'})
+        await asyncio.wait_for(inbox.done.wait(), timeout=5)
+    finally:
+        await first.stop()
+        await second.stop()
+
+    assert second.reconnects == 1
+    assert inbox.events == [(first.node_id, 'message', {'text': 'hello again'})]
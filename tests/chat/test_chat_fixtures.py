@@ -1,6 +1,36 @@
+import json
+
 import pytest
 
 from chat.routes import test_url
+from chat.services.rooms import RoomRegistry
+
+
+class FakeWebSocket:
+    """ Клиент, который читает все сразу: запоминает отправленные фреймы и закрытие. """
+
+    def __init__(self, closed=False, on_close=None):
+        self.closed = closed
+        self.close_code = None
+        self.close_message = None
+        self.sent = []
+        self.on_close = on_close
+
+    async def send_str(self, message):
+        self.sent.append(json.loads(message))
+
+    async def close(self, code=1000, message=b''):
+        self.closed = True
+        self.close_code = code
+        self.close_message = message
+        if self.on_close is not None:
+            self.on_close()
+
+
+def make_registry(**kwargs):
+    """ Реестр комнат с маленькими очередями и буферами истории. """
+    return RoomRegistry(send_queue_size=10, slow_consumer_policy='drop_oldest',
+                        history_size=10, history_max_chars=100, **kwargs)
 
 
 @pytest.fixture
@@ -15,6 +45,11 @@ def get_all_chat_message_sql():
     return "SELECT chat_message.nickname, chat_message.created_date, chat_message.text FROM chat_message WHERE chat_message.created_date > CURRENT_DATE ORDER BY chat_message.created_date"
 
 
+@pytest.fixture
+def get_last_chat_message_sql():
+    return "SELECT chat_message.id, chat_message.room, chat_message.nickname, chat_message.created_date, chat_message.text FROM chat_message WHERE chat_message.room = 'main' AND chat_message.created_date > CURRENT_DATE ORDER BY chat_message.created_date DESC, chat_message.id DESC LIMIT 30"
+
+
 @pytest.fixture
 def create_chat_message_request_data():
     return {
@@ -1,5 +1,20 @@
+import json
+
+import aiohttp
+import pytest
+from aiohttp import WSCloseCode
+
+from chat.routes import history_url, export_url
+from chat.services.connections import ConnectionRegistry
+from chat.services.drain import drain, RECONNECT
+from chat.services.ratelimit import RateLimiter, DISCONNECT
+from chat.services.statements import create_chat_message
 from utils.dialect import LiteralDialect
-from chat.services.querysets import create_chat_message_queryset, get_all_chat_message_queryset
+from chat.services.querysets import (
+    create_chat_message_queryset,
+    get_all_chat_message_queryset,
+    get_last_chat_message_queryset,
+)
 from .test_chat_fixtures import *
 
 
@@ -15,8 +30,141 @@ def test_get_all_chat_message_queryset(get_all_chat_message_sql):
     assert orm_sql == get_all_chat_message_sql
 
 
+def test_get_last_chat_message_queryset(get_last_chat_message_sql):
+    queryset = get_last_chat_message_queryset('main', limit=30)
+    orm_sql = LiteralDialect.get_sql_with_var(queryset)
+
+    assert orm_sql == get_last_chat_message_sql
+
+
 async def test_create_chat_message(create_chat_message_request_data):
     await create_chat_message_queryset(**create_chat_message_request_data)
     messeges = await get_all_chat_message_queryset().gino.first()
 
     assert messeges[2] == 'text'
+
+
+async def test_history_view_pages_and_revalidates(client_get):
+    for i in range(3):
+        await create_chat_message(nickname='tester', text=f'page {i}', room='history_api')
+
+    response, body = await client_get(url=history_url, params={'room': 'history_api', 'limit': 2})
+    assert response.status == 200
+    assert [mes['text'] for mes in body['messages']] == ['page 1', 'page 2']
+
+    response, older = await client_get(
+        url=history_url, params={'room': 'history_api', 'limit': 2, 'before': body['next']})
+    assert [mes['text'] for mes in older['messages']] == ['page 0']
+    assert older['next'] is None
+
+    response = await client_get(
+        url=history_url,
+        params={'room': 'history_api', 'limit': 2, 'before': body['next']},
+        headers={'If-None-Match': response.headers['ETag']},
+        return_json_body=False,
+    )
+    assert response.status == 304
+
+
+async def test_export_streams_ndjson(client_get):
+    await create_chat_message(nickname='tester', text='exported', room='export')
+
+    response = await client_get(url=export_url, params={'room': 'export'}, return_json_body=False)
+    lines = (await response.text()).splitlines()
+
+    assert response.status == 200
+    assert response.headers['Content-Type'].startswith('application/x-ndjson')
+    assert [json.loads(line)['text'] for line in lines] == ['exported']
+
+
+async def test_export_rejects_bad_range(client_get):
+    response = await client_get(
+        url=export_url, params={'from': '2020-11-02', 'to': '2020-11-01'}, return_json_body=False)
+
+    assert response.status == 400
+
+
+async def test_websocket_resumes_since_message(client):
+    first = await create_chat_message(nickname='tester', text='seen', room='resume')
+    await create_chat_message(nickname='tester', text='missed', room='resume')
+
+    ws = await client.ws_connect(f'/ws/resume/reader?since={first["id"]}')
+    try:
+        presence = await ws.receive_json(timeout=5)
+        resume = await ws.receive_json(timeout=5)
+        missed = await ws.receive_json(timeout=5)
+    finally:
+        await ws.close()
+
+    assert presence['type'] == 'presence'
+    assert resume == {'type': 'resume', 'since': first['id'], 'complete': True}
+    assert missed['text'] == 'missed'
+
+
+async def test_websocket_rejects_bad_since_before_upgrade(client):
+    with pytest.raises(aiohttp.WSServerHandshakeError) as error:
+        await client.ws_connect('/ws/resume/reader?since=abc')
+
+    assert error.value.status == 400
+
+
+async def test_websocket_rejects_long_nickname(client):
+    with pytest.raises(aiohttp.WSServerHandshakeError) as error:
+        await client.ws_connect(f'/ws/resume/{"x" * 60}')
+
+    assert error.value.status == 400
+
+
+async def receive_until_closed(ws):
+    """ Читает фреймы до закрытия сокета сервером. Возвращает JSON-фреймы. """
+    frames = []
+    while True:
+        msg = await ws.receive(timeout=5)
+        if msg.type != aiohttp.WSMsgType.TEXT:
+            return frames
+        frames.append(json.loads(msg.data))
+
+
+async def test_websocket_server_close_keeps_code(client):
+    ws = await client.ws_connect('/ws/close_code/slow')
+    await ws.receive_json(timeout=5)
+
+    sender, = client.app.connections.sessions('slow')
+    sender.close(WSCloseCode.POLICY_VIOLATION, b'slow consumer')
+    await receive_until_closed(ws)
+
+    assert ws.close_code == WSCloseCode.POLICY_VIOLATION
+
+
+async def test_websocket_rate_limit_disconnects_with_policy_violation(client):
+    limiter = client.app.limiter
+    client.app.limiter = RateLimiter(rate=0.001, burst=1, policy=DISCONNECT)
+    try:
+        ws = await client.ws_connect('/ws/rate_limit/flooder')
+        await ws.receive_json(timeout=5)
+        await ws.send_str('first')
+        await ws.send_str('second')
+        await receive_until_closed(ws)
+    finally:
+        client.app.limiter = limiter
+
+    assert ws.close_code == WSCloseCode.POLICY_VIOLATION
+
+
+async def test_websocket_drain_closes_with_going_away(client):
+    app = client.app
+    # Остановка закрывает рассылку всех комнат: общие комнаты приложения не трогаем
+    rooms, connections = app.rooms, app.connections
+    app.rooms, app.connections = make_registry(), ConnectionRegistry()
+    try:
+        ws = await client.ws_connect('/ws/drain/reader')
+        await ws.receive_json(timeout=5)
+
+        assert await drain(app, timeout=5, reconnect_delay=100, reconnect_jitter=0) == 1
+        frames = await receive_until_closed(ws)
+    finally:
+        app.rooms, app.connections = rooms, connections
+        app.draining = False
+
+    assert frames == [{'type': RECONNECT, 'after_ms': 100}]
+    assert ws.close_code == WSCloseCode.GOING_AWAY
@@ -0,0 +1,27 @@
+from chat.services.connections import ConnectionRegistry
+
+
+class FakeSender:
+
+    def __init__(self, user):
+        self.user = user
+
+
+def test_registry_keeps_several_sessions_per_user():
+    registry = ConnectionRegistry()
+    first, second, other = FakeSender('alice'), FakeSender('alice'), FakeSender('bob')
+    for sender in (first, second, other):
+        registry.add(sender)
+
+    assert len(registry) == 3
+    assert list(registry) == [first, second, other]
+    assert list(registry.sessions('alice')) == [first, second]
+
+    registry.remove(first)
+    registry.remove(first)
+    assert first not in registry
+    assert list(registry.sessions('alice')) == [second]
+
+    registry.remove(second)
+    assert registry.count('alice') == 0
+    assert list(registry) == [other]
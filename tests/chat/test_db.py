@@ -0,0 +1,50 @@
+from utils.db import GinoDB
+from config.settings import CHAT_DB
+
+
+def test_pool_config():
+    settings = {'chat': {'test': {
+        'dsn': 'postgresql://localhost/chat',
+        'pool_min_size': 2,
+        'pool_max_size': 4,
+        'max_inactive_connection_lifetime': 60.0,
+        'statement_cache_size': 0,
+        'command_timeout': None,
+    }}}
+    db = GinoDB(name='chat', build='test', db_settings=settings)
+
+    # Размеры пула Gino.init_app читает сам, остальное уходит в asyncpg.create_pool
+    assert db.pool_config() == {
+        'dsn': 'postgresql://localhost/chat',
+        'pool_min_size': 2,
+        'pool_max_size': 4,
+        'kwargs': {'max_inactive_connection_lifetime': 60.0, 'statement_cache_size': 0},
+    }
+
+
+def test_pool_stats_without_engine():
+    db = GinoDB(name='chat', build='test', db_settings={'chat': {'test': {}}})
+
+    assert db.pool_stats() == {}
+
+
+async def test_pool_stats():
+    cfg = CHAT_DB.cfg
+    pool = CHAT_DB.bound_engine.bind.raw_pool
+    # Настройки конфига дошли до пула
+    assert pool._minsize == cfg['pool_min_size']
+    assert pool._maxsize == cfg['pool_max_size']
+    assert pool._max_inactive_connection_lifetime == cfg['max_inactive_connection_lifetime']
+
+    before = CHAT_DB.pool_stats()
+    assert before['max_size'] == cfg['pool_max_size']
+    assert before['size'] >= cfg['pool_min_size']
+    assert before['idle'] == before['size'] - before['in_use']
+    assert before['waiters'] == 0
+
+    async with CHAT_DB.bound_engine.bind.acquire() as conn:
+        await conn.scalar('SELECT 1')
+        during = CHAT_DB.pool_stats()
+
+    assert during['in_use'] == before['in_use'] + 1
+    assert CHAT_DB.pool_stats()['in_use'] == before['in_use']
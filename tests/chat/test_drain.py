@@ -0,0 +1,40 @@
+from aiohttp import web, WSCloseCode
+
+from chat.services.drain import drain, RECONNECT
+from chat.services.encoders import Frame
+from chat.services.presence import LEAVE
+
+from .test_chat_fixtures import FakeWebSocket, make_registry
+
+
+async def test_drain_sends_reconnect_and_closes():
+    app = web.Application()
+    app.rooms = make_registry()
+    room = app.rooms.acquire('drain')
+    senders = [room.fanout.register(user, FakeWebSocket()) for user in ('alice', 'bob')]
+
+    assert await drain(app, timeout=1, reconnect_delay=100, reconnect_jitter=50) == 2
+
+    assert app.draining
+    for sender in senders:
+        assert sender.ws.closed and sender.ws.close_code == WSCloseCode.GOING_AWAY
+        event, = sender.ws.sent
+        assert event['type'] == RECONNECT and 100 <= event['after_ms'] <= 150
+
+
+async def test_drain_does_not_broadcast_leave_events():
+    app = web.Application()
+    app.rooms = make_registry()
+    room = app.rooms.acquire('drain_many')
+
+    # Как обработчик WebSocket.get: закрытие сокета рассылает остальным событие выхода
+    def leave():
+        room.fanout.broadcast(Frame({'type': LEAVE, 'user': 'someone'}))
+
+    senders = [room.fanout.register(f'user{i}', FakeWebSocket(on_close=leave)) for i in range(200)]
+
+    assert await drain(app, timeout=1, reconnect_delay=100, reconnect_jitter=50) == 200
+
+    for sender in senders:
+        assert [event['type'] for event in sender.ws.sent] == [RECONNECT]
+        assert sender.closing and not len(sender)
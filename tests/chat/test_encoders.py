@@ -0,0 +1,19 @@
+import json
+
+import pytest
+
+from chat.services.encoders import Frame, BatchFrame, msgpack, msgpack_loads
+
+
+def test_batch_frame_joins_encoded_json():
+    frames = [Frame({'text': 'a'}), Frame({'text': 'b'})]
+
+    assert json.loads(BatchFrame(frames).json) == [{'text': 'a'}, {'text': 'b'}]
+
+
+@pytest.mark.skipif(msgpack is None, reason='msgpack is not installed')
+@pytest.mark.parametrize('size', [1, 20, 70000])
+def test_batch_frame_is_msgpack_array(size):
+    frames = [Frame({'text': str(i)}) for i in range(size)]
+
+    assert msgpack_loads(BatchFrame(frames).msgpack) == [frame.message for frame in frames]
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from chat.services.encoders import Frame
+from chat.services.fanout import FanOut, DROP_OLDEST, DROP_NEWEST, DISCONNECT
+
+
+class StalledWebSocket:
+    """ Клиент, который ничего не читает: отправка висит до закрытия. """
+
+    def __init__(self):
+        self.closed = False
+        self._stalled = asyncio.Event()
+
+    async def send_str(self, message):
+        await self._stalled.wait()
+
+    async def close(self, code=1000, message=b''):
+        self.closed = True
+
+
+@pytest.mark.parametrize('policy, expected', [
+    (DROP_OLDEST, ['3', '4']),
+    (DROP_NEWEST, ['0', '1']),
+])
+async def test_fanout_full_queue_policy(policy, expected):
+    fanout = FanOut(maxsize=2, policy=policy)
+    sender = fanout.register('tester', StalledWebSocket())
+    await asyncio.sleep(0)
+
+    for i in range(5):
+        fanout.broadcast(Frame(i))
+
+    assert [frame.json for frame in sender._queue] == expected
+    assert sender.dropped == 3
+    fanout.unregister(sender)
+
+
+async def test_fanout_disconnects_slow_consumer():
+    fanout = FanOut(maxsize=1, policy=DISCONNECT)
+    ws = StalledWebSocket()
+    fanout.register('tester', ws)
+    await asyncio.sleep(0)
+
+    for i in range(3):
+        fanout.broadcast(Frame(i))
+    await asyncio.sleep(0)
+
+    assert ws.closed
+
+
+async def test_fanout_closes_sender_on_send_error():
+    class BrokenWebSocket(StalledWebSocket):
+        async def send_str(self, message):
+            raise RuntimeError('Cannot write to closing transport')
+
+    fanout = FanOut(maxsize=10, policy=DROP_OLDEST)
+    ws = BrokenWebSocket()
+    sender = fanout.register('tester', ws)
+
+    fanout.broadcast(Frame(1))
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+
+    assert sender.closing and ws.closed
+    assert not sender.put(Frame(2))
+    fanout.unregister(sender)
+
+
+async def test_fanout_keeps_sessions_of_same_user():
+    fanout = FanOut(maxsize=10, policy=DROP_OLDEST)
+    first = fanout.register('tester', StalledWebSocket())
+    second = fanout.register('tester', StalledWebSocket())
+    await asyncio.sleep(0)
+
+    fanout.broadcast(Frame(1))
+    fanout.broadcast(Frame(2))
+
+    assert len(fanout) == 2
+    # Первое сообщение каждая сессия уже отправляет, второе ждет в очереди
+    assert [frame.json for frame in first._queue] == [frame.json for frame in second._queue] == ['2']
+
+    fanout.unregister(first)
+    assert list(fanout) == [second]
+    fanout.unregister(second)
+
+
+async def test_fanout_coalesces_within_window():
+    fanout = FanOut(maxsize=10, policy=DROP_OLDEST, coalesce_window=0.01, coalesce_max_batch=3)
+    sender = fanout.register('tester', StalledWebSocket())
+    await asyncio.sleep(0)
+
+    for i in range(4):
+        fanout.broadcast(Frame(i))
+
+    assert [frame.json for frame in sender._queue] == ['[0,1,2]']
+
+    await asyncio.sleep(0.02)
+
+    # Первый фрейм уже забрала задача отправки
+    assert [frame.json for frame in sender._queue] == ['3']
+    fanout.unregister(sender)
+
+
+class CompressingWebSocket:
+    """ Клиент с согласованным сжатием: запоминает, сжималось ли каждое сообщение. """
+
+    class Writer:
+        compress = 15
+
+    def __init__(self):
+        self.closed = False
+        self._writer = self.Writer()
+        self.sent = []
+
+    async def send_str(self, message):
+        self.sent.append((message, bool(self._writer.compress)))
+
+    async def close(self, code=1000, message=b''):
+        self.closed = True
+
+
+async def test_fanout_compresses_only_large_messages():
+    fanout = FanOut(maxsize=10, policy=DROP_OLDEST, compress_min_size=6)
+    ws = CompressingWebSocket()
+    sender = fanout.register('tester', ws)
+
+    fanout.broadcast(Frame('abc'))
+    fanout.broadcast(Frame('abcdef'))
+    await asyncio.sleep(0)
+
+    assert ws.sent == [('"abc"', False), ('"abcdef"', True)]
+    fanout.unregister(sender)
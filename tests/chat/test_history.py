@@ -0,0 +1,56 @@
+import datetime
+
+from chat.services.history import HistoryMessage, MessageHistory
+
+
+def make_message(id, text='text'):
+    return HistoryMessage(id, 'tester', text, datetime.datetime.now())
+
+
+def test_history_is_miss_until_warmed():
+    history = MessageHistory('main', capacity=10, max_chars=100)
+    history.append(make_message(1))
+
+    assert history.last(5) is None
+    assert history.misses == 1
+
+
+def test_history_evicts_by_capacity_and_chars():
+    history = MessageHistory('main', capacity=3, max_chars=10)
+    history.warmed = True
+    for i in range(5):
+        history.append(make_message(i, text='abc'))
+
+    assert [mes.id for mes in history.last(3)] == [2, 3, 4]
+    assert history.chars == 9
+
+    history.append(make_message(5, text='abcdef'))
+
+    assert [mes.id for mes in history.last(2)] == [4, 5]
+    assert history.chars <= 10
+    assert history.last(3) is None
+
+
+def test_history_skips_yesterday():
+    history = MessageHistory('main', capacity=10, max_chars=100)
+    history.warmed = True
+    history.append(HistoryMessage(1, 'tester', 'old', datetime.datetime.now() - datetime.timedelta(days=1)))
+    history.append(make_message(2))
+
+    assert [mes.id for mes in history.last(10)] == [2]
+    assert history.hits == 1
+
+
+async def test_history_since_serves_missed_messages_from_memory():
+    history = MessageHistory('main', capacity=10, max_chars=100)
+    history.warmed = True
+    for i in range(1, 6):
+        history.append(make_message(i))
+
+    messages, complete = await history.since(2, limit=10)
+    assert [mes.id for mes in messages] == [3, 4, 5]
+    assert complete
+
+    messages, complete = await history.since(2, limit=2)
+    assert [mes.id for mes in messages] == [4, 5]
+    assert not complete
@@ -0,0 +1,37 @@
+import asyncio
+
+from chat.services import ids
+from chat.services.ids import IdAllocator
+
+
+async def test_id_allocator_does_not_wait_for_db(monkeypatch):
+    reserved = asyncio.Event()
+
+    async def reserve_message_ids(count):
+        await reserved.wait()
+        return list(range(1, count + 1))
+
+    monkeypatch.setattr(ids, 'reserve_message_ids', reserve_message_ids)
+    allocator = IdAllocator(block_size=4)
+
+    # Блока еще нет: id выдаст запись в БД
+    assert allocator.next() is None
+    assert allocator.next() is None
+
+    reserved.set()
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert [allocator.next() for _ in range(3)] == [1, 2, 3]
+
+
+async def test_id_allocator_survives_db_errors(monkeypatch):
+    async def reserve_message_ids(count):
+        raise ConnectionRefusedError()
+
+    monkeypatch.setattr(ids, 'reserve_message_ids', reserve_message_ids)
+    allocator = IdAllocator(block_size=4)
+
+    assert allocator.next() is None
+    await asyncio.sleep(0)
+    assert allocator.next() is None
+    assert len(allocator) == 0
@@ -0,0 +1,25 @@
+from routes import metrics_url
+from utils.metrics import Histogram
+
+
+def test_histogram_render():
+    histogram = Histogram('test_seconds', 'Test', buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+
+    assert histogram.render().splitlines()[2:] == [
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        'test_seconds_sum 5.55',
+        'test_seconds_count 3',
+    ]
+
+
+async def test_metrics_view(client_get):
+    response = await client_get(url=metrics_url, return_json_body=False)
+    body = await response.text()
+
+    assert response.status == 200
+    assert 'chat_connections 0' in body
+    assert '# TYPE chat_broadcast_seconds histogram' in body
@@ -0,0 +1,68 @@
+import datetime
+
+import pytest
+
+from chat.services.partitions import (
+    DETACH,
+    DROP,
+    MAINTENANCE_LOCK,
+    create_partitions,
+    list_partitions,
+    maintain_partitions,
+    partition_day,
+    partition_name,
+    retire_partitions,
+)
+from config.settings import CHAT_ENGINE as db
+
+
+def test_partition_name():
+    day = datetime.date(2021, 1, 25)
+
+    assert partition_name(day) == 'chat_message_p20210125'
+    assert partition_day(partition_name(day)) == day
+
+
+async def test_create_partitions_ahead():
+    today = datetime.date.today() + datetime.timedelta(days=100)
+
+    created = await create_partitions(days_ahead=1, today=today)
+    partitions = dict(await list_partitions())
+
+    try:
+        assert created == [partition_name(today), partition_name(today + datetime.timedelta(days=1))]
+        assert partitions[partition_name(today)] == today
+        assert await create_partitions(days_ahead=1, today=today) == []
+    finally:
+        for name in created:
+            await db.status(f'DROP TABLE "{name}"')
+
+
+@pytest.mark.parametrize('mode, offset', [(DROP, 1000), (DETACH, 1001)])
+async def test_retire_partitions(mode, offset):
+    day = datetime.date.today() - datetime.timedelta(days=offset)
+    name = partition_name(day)
+    assert await create_partitions(days_ahead=0, today=day) == [name]
+
+    try:
+        # Старше сегодняшнего (для теста - следующего за day) дня только эта партиция
+        retired = await retire_partitions(keep_days=1, mode=mode, today=day + datetime.timedelta(days=1))
+
+        assert retired == [name]
+        assert name not in dict(await list_partitions())
+        table = await db.scalar(db.text('SELECT to_regclass(:name)::text'), name=name)
+        assert table == (name if mode == DETACH else None)
+    finally:
+        await db.status(f'DROP TABLE IF EXISTS "{name}"')
+
+
+async def test_maintain_partitions_runs_in_one_worker():
+    async with db.acquire() as conn:
+        # Обслуживание уже идет в другом воркере
+        assert await conn.scalar(db.text('SELECT pg_try_advisory_lock(:key)'), key=MAINTENANCE_LOCK)
+        try:
+            assert await maintain_partitions(days_ahead=0, keep_days=10000) is False
+        finally:
+            await conn.scalar(db.text('SELECT pg_advisory_unlock(:key)'), key=MAINTENANCE_LOCK)
+
+    assert await maintain_partitions(days_ahead=0, keep_days=10000) is True
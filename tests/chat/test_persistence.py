@@ -0,0 +1,60 @@
+import datetime
+
+from chat.services.history import HistoryMessage
+from chat.services.persistence import MessagePersister
+from config.models.chat_models import ChatMessage
+
+
+def make_persister(**kwargs):
+    params = {
+        'batch_size': 100,
+        'flush_interval': 60,
+        'max_pending': 10,
+        'retry_delay': 0.1,
+        'max_retry_delay': 0.1,
+    }
+    params.update(kwargs)
+    return MessagePersister(**params)
+
+
+def make_message(text, nickname='persister'):
+    return HistoryMessage(None, nickname, text, datetime.datetime.now())
+
+
+def test_persister_bounds_pending():
+    persister = make_persister(max_pending=2)
+    for i in range(3):
+        persister.add(make_message(f'text {i}'))
+
+    assert len(persister) == 2
+    assert persister.dropped == 1
+
+
+async def test_persister_drains_on_stop():
+    persister = make_persister()
+    persister.start()
+    for i in range(3):
+        persister.add(make_message(f'text {i}'))
+
+    await persister.stop(timeout=5)
+    rows = await ChatMessage.query.where(ChatMessage.nickname == 'persister') \
+        .order_by(ChatMessage.id).gino.all()
+
+    assert [row.text for row in rows] == ['text 0', 'text 1', 'text 2']
+    assert persister.written == 3
+
+
+async def test_persister_drops_only_bad_rows():
+    persister = make_persister()
+    persister.start()
+    persister.add(make_message('good 0', nickname='persister_rows'))
+    persister.add(make_message('bad', nickname='x' * 60))
+    persister.add(make_message('good 1', nickname='persister_rows'))
+
+    await persister.stop(timeout=5)
+    rows = await ChatMessage.query.where(ChatMessage.nickname == 'persister_rows') \
+        .order_by(ChatMessage.id).gino.all()
+
+    assert [row.text for row in rows] == ['good 0', 'good 1']
+    assert persister.written == 2
+    assert persister.dropped == 1
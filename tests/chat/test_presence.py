@@ -0,0 +1,38 @@
+from chat.services.presence import Presence, JOIN, LEAVE, PRESENCE
+
+
+def test_presence_events_and_versions():
+    presence = Presence()
+
+    assert presence.join('alice') == {'type': JOIN, 'user': 'alice', 'version': 1}
+    assert presence.join('bob')['version'] == 2
+    assert presence.snapshot() == {'type': PRESENCE, 'users': ['alice', 'bob'], 'version': 2}
+
+    assert presence.leave('alice') == {'type': LEAVE, 'user': 'alice', 'version': 3}
+    assert presence.leave('alice') is None
+
+
+def test_presence_counts_sessions():
+    presence = Presence()
+
+    assert presence.join('alice') is not None
+    assert presence.join('alice') is None
+    assert presence.leave('alice') is None
+    assert 'alice' in presence
+    assert presence.leave('alice')['type'] == LEAVE
+    assert presence.version == 2
+
+
+def test_presence_syncs_remote_nodes():
+    presence = Presence()
+    presence.join('alice')
+
+    events = presence.sync_node('worker-2', {'alice': 1, 'bob': 2})
+
+    assert events == [{'type': JOIN, 'user': 'bob', 'version': 2}]
+    assert presence.leave('alice') is None
+
+    events = presence.drop_node('worker-2')
+
+    assert {(event['type'], event['user']) for event in events} == {(LEAVE, 'alice'), (LEAVE, 'bob')}
+    assert len(presence) == 0
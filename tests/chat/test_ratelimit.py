@@ -0,0 +1,29 @@
+import pytest
+
+from chat.services.ratelimit import RateLimiter, THROTTLE
+
+
+def test_rate_limiter_burst_and_refill():
+    limiter = RateLimiter(rate=2, burst=3, policy=THROTTLE)
+
+    assert [limiter.acquire('tester', now=0) for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire('tester', now=0) == pytest.approx(0.5)
+    assert limiter.acquire('other', now=0) == 0
+
+    assert limiter.acquire('tester', now=0.5) == 0
+    assert limiter.acquire('tester', now=0.5) > 0
+
+
+def test_rate_limiter_prunes_full_buckets():
+    limiter = RateLimiter(rate=1, burst=2, policy=THROTTLE)
+    limiter.acquire('idle', now=0)
+    limiter.acquire('busy', now=9)
+    limiter.acquire('busy', now=10)
+
+    assert limiter.prune(now=10) == 1
+    assert len(limiter) == 1
+
+
+def test_rate_limiter_rejects_unknown_policy():
+    with pytest.raises(ValueError):
+        RateLimiter(rate=1, burst=1, policy='ignore')
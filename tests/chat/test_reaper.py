@@ -0,0 +1,28 @@
+import asyncio
+import time
+
+from chat.services.reaper import Reaper
+from chat.services.metrics import CONNECTIONS_REAPED
+
+from .test_chat_fixtures import FakeWebSocket, make_registry
+
+
+async def test_reaper_closes_dead_and_idle_connections():
+    rooms = make_registry()
+    room = rooms.acquire('reaper')
+    dead = room.fanout.register('dead', FakeWebSocket(closed=True))
+    idle = room.fanout.register('idle', FakeWebSocket())
+    active = room.fanout.register('active', FakeWebSocket())
+    idle.last_seen = time.monotonic() - 120
+    reaped = CONNECTIONS_REAPED.value
+
+    reaper = Reaper(rooms, interval=60, idle_timeout=60)
+
+    assert reaper.reap() == 2
+    assert reaper.reap() == 0
+    await asyncio.sleep(0)
+
+    assert dead.closing and idle.closing and not active.closing
+    assert idle.ws.close_message == b'idle timeout'
+    assert CONNECTIONS_REAPED.value == reaped + 2
+    room.fanout.unregister(active)
@@ -0,0 +1,26 @@
+import time
+
+from aiohttp import web
+
+from chat.services.backplane import LocalBackplane
+from chat.services.presence import JOIN
+from chat.services.relay import Relay, STATE
+
+from .test_chat_fixtures import make_registry
+
+
+def test_relay_drops_silent_node():
+    app = web.Application()
+    app.rooms = make_registry()
+    relay = Relay(app, LocalBackplane(channel='relay', max_payload=7900), heartbeat=10, node_timeout=30)
+
+    relay.on_event('worker-2', JOIN, {'room': 'python', 'user': 'alice'})
+    relay.on_event('worker-3', STATE, {'rooms': {'python': {'bob': 1}}})
+    assert app.rooms.get('python').presence.users == ['alice', 'bob']
+
+    # worker-3 шлет heartbeat, worker-2 упал без BYE
+    relay.on_event('worker-3', STATE, {'rooms': {'python': {'bob': 1}}})
+    relay._nodes['worker-2'] = time.monotonic() - 60
+
+    assert relay.expire() == 1
+    assert app.rooms.get('python').presence.users == ['bob']
@@ -0,0 +1,54 @@
+import datetime
+
+from chat.services.history import HistoryMessage
+
+from .test_chat_fixtures import make_registry
+
+
+def test_rooms_are_created_lazily_and_collected():
+    rooms = make_registry()
+
+    room = rooms.acquire('python')
+    assert rooms.acquire('python') is room
+    assert len(rooms) == 1
+
+    rooms.release(room)
+    assert rooms.get('python') is room
+
+    rooms.release(room)
+    assert rooms.get('python') is None
+    assert len(rooms) == 0
+
+
+def test_room_with_remote_users_is_kept():
+    rooms = make_registry()
+
+    room = rooms.ensure('python')
+    room.presence.join('alice', node='worker-2')
+    rooms.collect(room)
+    assert rooms.get('python') is room
+
+    room.presence.drop_node('worker-2')
+    rooms.collect(room)
+    assert rooms.get('python') is None
+
+
+def test_collected_room_keeps_recent_messages():
+    rooms = make_registry(keep_rooms=('main',), idle_histories=1, idle_history_ttl=30)
+
+    main = rooms.acquire('main')
+    rooms.release(main)
+    assert rooms.get('main') is main
+
+    room = rooms.acquire('python')
+    now = datetime.datetime.now()
+    old = HistoryMessage(1, 'alice', 'persisted long ago', now - datetime.timedelta(hours=1), 'python')
+    recent = HistoryMessage(2, 'alice', 'not persisted yet', now, 'python')
+    room.history.append(old)
+    room.history.append(recent)
+    rooms.release(room)
+    assert rooms.get('python') is None
+
+    history = rooms.acquire('python').history
+    assert history.newer_than(now - datetime.timedelta(days=1)) == [recent]
+    assert not history.warmed
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from chat.services.singleflight import SingleFlight
+
+
+async def test_single_flight_shares_one_call():
+    loads = SingleFlight(ttl=60)
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return ['message']
+
+    results = await asyncio.gather(*(loads.do('main', load) for _ in range(10)))
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+
+    # Пока не истек ttl, результат отдается без запроса
+    assert await loads.do('main', load) is results[0]
+    assert await loads.do('other', load) == ['message']
+    assert len(calls) == 2
+
+
+async def test_single_flight_does_not_cache_errors():
+    loads = SingleFlight(ttl=60)
+
+    async def fail():
+        raise ValueError('db is down')
+
+    async def load():
+        return 'ok'
+
+    with pytest.raises(ValueError):
+        await loads.do('main', fail)
+    assert await loads.do('main', load) == 'ok'
+
+
+async def test_single_flight_without_ttl():
+    loads = SingleFlight(ttl=0)
+    calls = []
+
+    async def load():
+        calls.append(1)
+
+    await loads.do('main', load)
+    await loads.do('main', load)
+    assert len(calls) == 2 and not len(loads)
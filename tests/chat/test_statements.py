@@ -0,0 +1,14 @@
+from chat.services.history import HistoryMessage
+from chat.services.statements import create_chat_message, get_last_chat_messages
+
+
+async def test_create_and_get_last_chat_messages():
+    for i in range(3):
+        await create_chat_message(nickname='statements', text=f'text {i}', room='statements')
+
+    records = await get_last_chat_messages('statements', limit=2)
+    messages = [HistoryMessage.from_record(record) for record in records]
+
+    assert [mes.text for mes in messages] == ['text 2', 'text 1']
+    assert messages[0].room == 'statements'
+    assert messages[0].id > messages[1].id
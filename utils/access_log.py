@@ -0,0 +1,104 @@
+import asyncio
+import collections
+import random
+from typing import Dict, Optional
+
+from loguru import logger
+
+from utils.metrics import REGISTRY
+
+ACCESS_LOG_RECORDS = REGISTRY.counter('access_log_records_total', 'Access log records written')
+ACCESS_LOG_DROPPED = REGISTRY.counter('access_log_dropped_total', 'Access log records dropped on overflow')
+
+
+def parse_sampling(value: str) -> Dict[str, float]:
+    """ ``'/metrics=0.01,/test=0.5'`` -> ``{'/metrics': 0.01, '/test': 0.5}`` """
+    sampling = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        prefix, rate = item.rsplit('=', 1)
+        sampling[prefix.strip()] = float(rate)
+    return sampling
+
+
+class AccessLog:
+    """
+    Журнал запросов с записью в фоне.
+
+    ``record`` только кладет запись в ограниченную очередь и никогда не ждет:
+    если очередь переполнена, запись отбрасывается и учитывается в метрике.
+    Одна фоновая задача пишет записи пачками по ``batch_size`` штук или раз
+    в ``flush_interval`` секунд. Для частых путей можно писать только долю
+    запросов: ``sampling`` - префикс пути -> доля от 0 до 1.
+
+    Поля записи (path, status, duration, remote) передаются в loguru через
+    ``bind``, их можно выводить структурированно (``serialize=True``).
+
+    :param maxsize: размер очереди
+    :param batch_size: размер пачки
+    :param flush_interval: интервал записи неполной пачки, сек.
+    :param sampling: доли записываемых запросов по префиксам пути
+    """
+
+    def __init__(self, maxsize: int, batch_size: int, flush_interval: float,
+                 sampling: Optional[Dict[str, float]] = None):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sampling = sampling or {}
+
+        self._queue = collections.deque()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        """ Останавливает задачу и дописывает очередь. """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        while self._queue:
+            self._write_batch()
+
+    def record(self, path: str, status, duration: float, remote: Optional[str]) -> None:
+        for prefix, rate in self.sampling.items():
+            if path.startswith(prefix):
+                if random.random() >= rate:
+                    return
+                break
+
+        if len(self._queue) >= self.maxsize:
+            ACCESS_LOG_DROPPED.inc()
+            return
+
+        self._queue.append((path, status, duration, remote))
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self._wakeup.clear()
+            while self._queue:
+                self._write_batch()
+                # Отдаем управление между пачками, чтобы не задерживать запросы
+                await asyncio.sleep(0)
+
+    def _write_batch(self):
+        queue = self._queue
+
+        for _ in range(min(self.batch_size, len(queue))):
+            path, status, duration, remote = queue.popleft()
+            logger.bind(path=path, status=status, duration=duration, remote=remote).info(
+                f'{path}: STATUS: {status} {duration * 1000:.1f}ms {remote}'
+            )
+            ACCESS_LOG_RECORDS.inc()
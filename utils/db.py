@@ -1,12 +1,14 @@
 import asyncio
 from abc import abstractmethod, ABCMeta
 from dataclasses import dataclass
-from typing import Optional, ClassVar
+from typing import Optional, ClassVar, Union
 
-import asyncpg
 from gino_aiohttp import Gino
 
-GlobalDBSettings = dict[str, dict[str, dict[str, Optional[str]]]]
+GlobalDBSettings = dict[str, dict[str, dict[str, Optional[Union[str, int, float]]]]]
+
+# Параметры asyncpg.create_pool, которые можно задать в конфиге базы
+POOL_KWARGS = ('max_inactive_connection_lifetime', 'statement_cache_size', 'command_timeout')
 
 
 @dataclass
@@ -90,14 +92,25 @@ class GinoDB(BaseDB):
     """
 
     engine: ClassVar[Gino] = Gino
+    # Экземпляр движка, переданный в start_engine
+    bound_engine = None
 
     def __post_init__(self):
         self.cfg = self.db_settings[self.name][self.build]
 
     async def test_connection(self):
-        """"""
-        conn = await asyncpg.connect(dsn=self.cfg['dsn'])
-        asyncio.create_task(conn.close())
+        """
+        Проверяет подключение через пул и прогревает его: одновременно
+        берет ``pool_min_size`` соединений и выполняет на каждом ``SELECT 1``.
+        Вызывается на старте приложения, после привязки движка к пулу.
+        """
+        bind = self.bound_engine.bind
+
+        async def ping():
+            async with bind.acquire() as conn:
+                await conn.scalar('SELECT 1')
+
+        await asyncio.gather(*(ping() for _ in range(self.cfg.get('pool_min_size', 1))))
 
     async def configure_settings(self, build):
         """
@@ -112,8 +125,6 @@ class GinoDB(BaseDB):
             self.build = build
             self.__post_init__()
 
-        await self.test_connection()
-
     async def start_engine(self, app, extracted_engine: ClassVar[Gino]):
         """
         Пример использования на проекте mrmr112
@@ -157,6 +168,46 @@ class GinoDB(BaseDB):
         :type extracted_engine: Gino
         :return:
         """
-        dsn = self.cfg['dsn']
-        await extracted_engine.set_bind(dsn)
-        extracted_engine.init_app(app, self.cfg)
+        # Пул создает gino_aiohttp на старте приложения: ему же отдаем
+        # настройки пула, а проверку подключения ставим следом
+        extracted_engine.init_app(app, self.pool_config())
+        self.bound_engine = extracted_engine
+
+        async def check_connection(_):
+            await self.test_connection()
+
+        app.on_startup.append(check_connection)
+
+    def pool_config(self) -> dict:
+        """
+        Конфиг для ``Gino.init_app``: размеры пула он читает из
+        ``pool_min_size``/``pool_max_size``, остальное передает
+        в ``asyncpg.create_pool`` через ``kwargs``.
+        """
+        config = {key: value for key, value in self.cfg.items() if key not in POOL_KWARGS}
+        config['kwargs'] = {key: self.cfg[key] for key in POOL_KWARGS if self.cfg.get(key) is not None}
+        return config
+
+    def pool_stats(self) -> dict:
+        """
+        Состояние пула соединений asyncpg: ``size`` - открытые соединения,
+        ``in_use`` - выданные, ``idle`` - открытые и свободные, ``waiters`` -
+        корутины, ждущие свободного соединения, ``max_size`` - предел пула.
+        Пока движок не подключен, возвращает пустой словарь.
+        """
+        bind = getattr(self.bound_engine, 'bind', None)
+        if bind is None:
+            return {}
+
+        # asyncpg не отдает статистику пула публично: считаем по холдерам
+        pool = bind.raw_pool
+        size = sum(1 for holder in pool._holders if holder._con is not None)
+        in_use = len(pool._holders) - pool._queue.qsize()
+
+        return {
+            'size': size,
+            'in_use': in_use,
+            'idle': size - in_use,
+            'waiters': len(pool._queue._getters),
+            'max_size': len(pool._holders),
+        }